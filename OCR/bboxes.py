@@ -0,0 +1,45 @@
+import numpy as np
+import cv2
+
+# Detections of a frame are kept as one (N, 4, 2) float32 array of quadrilateral corners
+# (top-left, top-right, bottom-right, bottom-left) through scaling, shrinking and masking
+
+def empty_boxes():
+    return np.zeros((0, 4, 2), dtype=np.float32)
+
+def easyocr_boxes(results):
+    if not results:
+        return empty_boxes()
+    return np.array([res[0] for res in results], dtype=np.float32).reshape(-1, 4, 2)
+
+def easyocr_confidences(results):
+    return np.array([res[2] for res in results], dtype=np.float32)
+
+def tesseract_boxes(results, min_conf=0):
+    conf = np.array([float(c) for c in results['conf']], dtype=np.float32)
+    keep = conf > min_conf  # filter out weak detections
+    x = np.array(results['left'], dtype=np.float32)[keep]
+    y = np.array(results['top'], dtype=np.float32)[keep]
+    w = np.array(results['width'], dtype=np.float32)[keep]
+    h = np.array(results['height'], dtype=np.float32)[keep]
+    return np.stack([np.stack([x, y], axis=-1), np.stack([x + w, y], axis=-1),
+                     np.stack([x + w, y + h], axis=-1), np.stack([x, y + h], axis=-1)], axis=1)
+
+def tesseract_confidences(results, min_conf=0):
+    # Same filter as tesseract_boxes, rescaled from tesseract's 0-100 to EasyOCR's 0-1
+    conf = np.array([float(c) for c in results['conf']], dtype=np.float32)
+    return conf[conf > min_conf] / 100
+
+def scale_boxes(boxes, scale_factors=(1, 1), y_offset=0):
+    # Moves band boxes by the band offset and maps them back to the original frame size
+    return np.trunc((boxes + np.array([0, y_offset], dtype=np.float32)) * np.array(scale_factors, dtype=np.float32))
+
+def shrink_boxes(boxes, shrink_factor=1):
+    centers = (boxes[:, 0:1, :] + boxes[:, 2:3, :]) / 2
+    return np.trunc(centers + shrink_factor * (boxes - centers))
+
+def boxes_to_mask(shape, boxes):
+    mask = np.zeros(shape[:2], dtype=np.uint8)
+    if len(boxes):
+        cv2.fillPoly(mask, list(boxes.astype(np.int32)), 255)
+    return mask
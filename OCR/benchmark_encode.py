@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import tempfile
+import argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from media import MediaHandle
+from segment_writer import start_encoder, finish_encoder
+from common.encoder import ENCODER_PROFILES, can_feed_yuv, frame_bytes
+
+def load_frames(path, frame_limit):
+    frames = []
+    with MediaHandle(path) as media:
+        for frame in media.iter_frames():
+            frames.append(frame)
+            if len(frames) == frame_limit:
+                break
+        return frames, media.fps, media.bitrate
+
+def encode_fps(frames, fps, bitrate, profile, feed_yuv, output_path):
+    # Conversion to yuv420p is part of the timed loop, it runs in the OCR process in production
+    height, width = frames[0].shape[:2]
+    start = time.perf_counter()
+    process = start_encoder(output_path, width, height, fps, bitrate, profile, feed_yuv)
+    for frame in frames:
+        process.stdin.write(frame_bytes(frame, feed_yuv))
+    finish_encoder(process)
+    return len(frames) / (time.perf_counter() - start)
+
+def main(args):
+    frames, fps, bitrate = load_frames(args.input, args.frames)
+    if not frames:
+        print(f"No frames decoded from {args.input}")
+        return
+    height, width = frames[0].shape[:2]
+    feeds = [False, True] if can_feed_yuv(width, height) else [False]
+
+    print(f"{len(frames)} frames {width}x{height} @ {fps:.2f} fps from {args.input}")
+    print(f"{'profile':<12}{'codec':>12}{'feed':>9}{'encode fps':>12}{'size MB':>9}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in args.profiles.split(','):
+            profile = ENCODER_PROFILES[name]
+            for feed_yuv in feeds:
+                output_path = os.path.join(tmp_dir, f"{name}.mp4")
+                try:
+                    rate = encode_fps(frames, fps, bitrate, profile, feed_yuv, output_path)
+                except (BrokenPipeError, OSError) as e:
+                    # e.g. h264_nvenc without a GPU
+                    print(f"{name:<12}{profile.codec:>12}{'yuv420p' if feed_yuv else 'bgr24':>9}{'failed':>12}  {e}")
+                    continue
+                size = os.path.getsize(output_path) / 1024 ** 2 if os.path.exists(output_path) else 0
+                print(f"{name:<12}{profile.codec:>12}{'yuv420p' if feed_yuv else 'bgr24':>9}{rate:>12.1f}{size:>9.2f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the encoder profiles of the OCR output pipe on a reference clip")
+    parser.add_argument('--input', type=str, required=True, help="Reference clip to decode and re-encode")
+    parser.add_argument('--frames', type=int, default=300, help="Number of frames decoded into memory and encoded per run")
+    parser.add_argument('--profiles', type=str, default=','.join(ENCODER_PROFILES), help="Comma separated encoder profiles to benchmark")
+    args = parser.parse_args()
+
+    main(args)
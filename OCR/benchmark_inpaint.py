@@ -0,0 +1,57 @@
+import time
+import argparse
+import numpy as np
+import cv2
+from inpaint import INPAINT_FLAGS, Inpainter, inpaint_full_frame, inpaint_rois
+
+RESOLUTIONS = {'720p': (1280, 720), '1080p': (1920, 1080)}
+
+def synthetic_frame(width, height, seed=0):
+    # Smooth background with a burned-in caption line in the lower band and a logo in the upper band
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 255, (height // 8, width // 8, 3), dtype=np.uint8)
+    frame = cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC)
+    scale = height / 720
+    cv2.putText(frame, 'This is a burned-in caption line', (int(0.2 * width), int(0.9 * height)),
+                cv2.FONT_HERSHEY_SIMPLEX, 1.5 * scale, (255, 255, 255), int(3 * scale))
+    cv2.putText(frame, 'LOGO', (int(0.05 * width), int(0.1 * height)), cv2.FONT_HERSHEY_SIMPLEX, scale, (255, 255, 255), int(2 * scale))
+
+    word = np.zeros((height, width), dtype=np.uint8)
+    cv2.rectangle(word, (int(0.04 * width), int(0.05 * height)), (int(0.17 * width), int(0.12 * height)), 255, -1)
+    caption = word.copy()
+    cv2.rectangle(caption, (int(0.19 * width), int(0.84 * height)), (int(0.81 * width), int(0.93 * height)), 255, -1)
+    return frame, {'word': word, 'caption': caption}
+
+def time_per_frame(function, repeats):
+    function()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats * 1000
+
+def main(args):
+    print(f"{'resolution':<12}{'mask':>8}{'mask %':>8}{'algorithm':>11}{'full ms':>10}{'roi ms':>10}{'speedup':>9}")
+    for name, (width, height) in RESOLUTIONS.items():
+        frame, masks = synthetic_frame(width, height)
+        for mask_name, mask in masks.items():
+            coverage = 100 * np.count_nonzero(mask) / mask.size
+            prefix = f"{name:<12}{mask_name:>8}{coverage:>8.1f}"
+            for algorithm, flags in INPAINT_FLAGS.items():
+                full = time_per_frame(lambda: inpaint_full_frame(frame, mask, args.radius, flags), args.repeats)
+                roi = time_per_frame(lambda: inpaint_rois(frame, mask, args.radius, flags), args.repeats)
+                print(f"{prefix}{algorithm:>11}{full:>10.2f}{roi:>10.2f}{full / roi:>8.1f}x")
+
+            # Temporal fill is compared against the full-frame NS baseline
+            inpainter = Inpainter('temporal', args.radius)
+            inpainter(frame, mask)
+            full = time_per_frame(lambda: inpaint_full_frame(frame, mask, args.radius, INPAINT_FLAGS['ns']), args.repeats)
+            temporal = time_per_frame(lambda: inpainter(frame, mask), args.repeats)
+            print(f"{prefix}{'temporal':>11}{full:>10.2f}{temporal:>10.2f}{full / temporal:>8.1f}x")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark full-frame against ROI inpainting")
+    parser.add_argument('--repeats', type=int, default=20, help="Number of timed inpainting calls per configuration")
+    parser.add_argument('--radius', type=int, default=3, help="Inpainting radius in pixels")
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,77 @@
+import os
+import time
+import argparse
+import numpy as np
+from media import MediaHandle
+from bboxes import boxes_to_mask
+from engines import ENGINES
+from ocr_script import BANDS, ScalePolicy, default_ocr_scale, detect_text_batched, init_worker, initialize_engine
+
+def frame_masks(frames, frame_results):
+    return [boxes_to_mask(frame.shape, np.concatenate([results[band][0] for band in BANDS])) for frame, results in zip(frames, frame_results)]
+
+def mask_scores(reference, masks):
+    # Recall of the reference text pixels and IoU with them, summed over all frames
+    reference_pixels = sum(np.count_nonzero(mask) for mask in reference)
+    covered = sum(np.count_nonzero(ref & mask) for ref, mask in zip(reference, masks))
+    union = sum(np.count_nonzero(ref | mask) for ref, mask in zip(reference, masks))
+    return covered / reference_pixels if reference_pixels else 1.0, covered / union if union else 1.0
+
+def timed_detection(frames, batch_size, scale):
+    start = time.perf_counter()
+    frame_results = detect_text_batched(frames, batch_size, scale=scale)
+    return frame_results, (time.perf_counter() - start) / len(frames) * 1000
+
+def main(args):
+    init_worker(args.device if args.device != 'cpu' else False, os.cpu_count(), args.engine)
+    initialize_engine()
+    paths = sorted(os.path.join(args.input, name) for name in os.listdir(args.input) if name.endswith(('.mp4', '.webm')))[:args.clips]
+    settings = [('fixed', None)] + [('adaptive', float(height)) for height in args.min_text_heights.split(',')]
+    rows = {setting: {'ms': [], 'recall': [], 'iou': [], 'scale': []} for setting in settings}
+
+    for path in paths:
+        with MediaHandle(path) as media:
+            frames = media.sample_frames(args.frames)
+        if not frames:
+            continue
+        # The fixed scale is the reference, text it misses is not counted against the adaptive settings
+        detect_text_batched(frames[:1], args.batch_size)
+        reference_results, reference_ms = timed_detection(frames, args.batch_size, None)
+        reference = frame_masks(frames, reference_results)
+        for mode, min_text_height in settings:
+            if mode == 'fixed':
+                frame_results, ms, scale = reference_results, reference_ms, default_ocr_scale(frames[0].shape)
+            else:
+                policy = ScalePolicy(mode, min_text_height)
+                policy.update(reference_results[:1], frames[0].shape)
+                scale = policy.current(frames[0].shape)
+                frame_results, ms = timed_detection(frames, args.batch_size, scale)
+            recall, iou = mask_scores(reference, frame_masks(frames, frame_results))
+            row = rows[(mode, min_text_height)]
+            row['ms'].append(ms)
+            row['recall'].append(recall)
+            row['iou'].append(iou)
+            row['scale'].append(scale)
+
+    fixed_ms = np.mean(rows[('fixed', None)]['ms']) if rows[('fixed', None)]['ms'] else 0
+    print(f"{len(paths)} clips, {args.frames} sampled frames each, engine {args.engine}")
+    print(f"{'setting':<22}{'scale':>8}{'ms/frame':>10}{'speedup':>9}{'recall':>8}{'IoU':>7}")
+    for (mode, min_text_height), row in rows.items():
+        if not row['ms']:
+            continue
+        name = mode if min_text_height is None else f"{mode} {min_text_height:g}px"
+        ms = np.mean(row['ms'])
+        print(f"{name:<22}{np.mean(row['scale']):>8.3f}{ms:>10.1f}{fixed_ms / ms:>8.1f}x{np.mean(row['recall']):>8.3f}{np.mean(row['iou']):>7.3f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Accuracy and speed of the adaptive OCR scale against the fixed target size")
+    parser.add_argument('--input', type=str, required=True, help="Folder of sample clips")
+    parser.add_argument('--clips', type=int, default=50, help="Number of clips taken from the folder")
+    parser.add_argument('--frames', type=int, default=10, help="Number of frames sampled per clip")
+    parser.add_argument('--min_text_heights', type=str, default='12,16,20,24,32', help="Comma separated min_text_height values of the adaptive policy")
+    parser.add_argument('--batch_size', type=int, default=8, help="Number of frames OCRed in one batch")
+    parser.add_argument('--engine', type=str, default='easyocr', choices=tuple(ENGINES), help="OCR engine")
+    parser.add_argument('--device', type=str, default='cuda:0', help="Device of the EasyOCR engine, 'cpu' to run on CPU")
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,120 @@
+import os
+import json
+import hashlib
+import logging
+import zipfile
+import numpy as np
+
+CACHE_VERSION = 1
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_key(path, config):
+    # Clip content and every setting that changes the detections, shrink and inpainting settings
+    # are applied after the cache and are left out on purpose
+    config = dict(config, cache_version=CACHE_VERSION)
+    return hashlib.sha1((file_digest(path) + json.dumps(config, sort_keys=True)).encode()).hexdigest()
+
+class ClipDetections:
+    # Boxes and confidences of every (frame, band) OCR call of one clip, boxes are in original
+    # frame coordinates and not yet shrunk
+    def __init__(self, bands):
+        self.bands = tuple(bands)
+        self.calls = {}
+
+    def add(self, frame_index, band, boxes, confidences):
+        self.calls[(frame_index, band)] = (boxes, confidences)
+
+    def get(self, frame_index, band):
+        return self.calls.get((frame_index, band))
+
+    def frame_bands(self, frame_index):
+        return [band for band in self.bands if (frame_index, band) in self.calls]
+
+    def to_arrays(self):
+        keys = sorted(self.calls, key=lambda key: (key[0], self.bands.index(key[1])))
+        calls = np.array([[frame_index, self.bands.index(band)] for frame_index, band in keys], dtype=np.int32).reshape(-1, 2)
+        counts = np.array([len(self.calls[key][1]) for key in keys], dtype=np.int32)
+        boxes = [self.calls[key][0] for key in keys]
+        confidences = [self.calls[key][1] for key in keys]
+        return {
+            'calls': calls,
+            'counts': counts,
+            'boxes': np.concatenate(boxes).astype(np.float32) if boxes else np.zeros((0, 4, 2), dtype=np.float32),
+            'confidences': np.concatenate(confidences).astype(np.float32) if confidences else np.zeros(0, dtype=np.float32),
+        }
+
+    @classmethod
+    def from_arrays(cls, bands, arrays):
+        detections = cls(bands)
+        offsets = np.concatenate([[0], np.cumsum(arrays['counts'])])
+        for (frame_index, band_index), start, end in zip(arrays['calls'], offsets[:-1], offsets[1:]):
+            detections.add(int(frame_index), bands[band_index], arrays['boxes'][start:end], arrays['confidences'][start:end])
+        return detections
+
+class DetectionCache:
+    # One compressed .npz per clip and OCR config, least recently used entries are evicted once
+    # the cache directory grows over max_bytes
+    def __init__(self, cache_dir, max_bytes=10 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.total_bytes = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def load(self, key, bands):
+        path = self.path(key)
+        try:
+            with np.load(path) as arrays:
+                detections = ClipDetections.from_arrays(bands, {name: arrays[name] for name in arrays.files})
+            os.utime(path)
+            return detections
+        except (FileNotFoundError, zipfile.BadZipFile, KeyError, ValueError):
+            return None
+
+    def save(self, key, detections):
+        path = self.path(key)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as file:
+            np.savez_compressed(file, **detections.to_arrays())
+        os.replace(tmp_path, path)
+
+        # The directory is only rescanned when the running size estimate exceeds the budget
+        if self.total_bytes is None:
+            self.total_bytes = sum(size for _, size, _ in self.entries())
+        else:
+            self.total_bytes += os.path.getsize(path)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.npz'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                logging.info(f"Evicted detection cache entry {path}")
+            except FileNotFoundError:
+                continue
+        self.total_bytes = total
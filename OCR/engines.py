@@ -0,0 +1,131 @@
+import numpy as np
+import cv2
+from bboxes import easyocr_boxes, easyocr_confidences, empty_boxes, tesseract_boxes, tesseract_confidences
+
+try:
+    import easyocr
+except ImportError:
+    easyocr = None
+
+try:
+    from tesseract_backend import TesseractPool
+except ImportError:
+    TesseractPool = None
+
+# An engine only sees grayscale or BGR band crops, resizing, band cropping, OCR skipping, caching
+# and inpainting are done once by the pipeline for every engine. Boxes are (N, 4, 2) arrays in crop
+# coordinates and confidences are in [0, 1]
+
+class OCREngine:
+    name = None
+    # Longer frame side the frames are resized to before cropping, None keeps the original size
+    target_size = None
+
+    def detect_batch(self, crops, batch_size=8):
+        # List of (boxes, confidences), one per crop
+        raise NotImplementedError
+
+    def has_text(self, crops, text_threshold=0.7, batch_size=10):
+        raise NotImplementedError
+
+    def config(self):
+        # Everything that changes the detections, part of the detection cache key
+        return {'engine': self.name, 'target_size': self.target_size}
+
+    def close(self):
+        pass
+
+def pad_crops(crops):
+    # Zero padding at the bottom and right keeps the box coordinates and lets all crops share one batch
+    height = max(crop.shape[0] for crop in crops)
+    width = max(crop.shape[1] for crop in crops)
+    return [cv2.copyMakeBorder(crop, 0, height - crop.shape[0], 0, width - crop.shape[1], cv2.BORDER_CONSTANT, value=0)
+            for crop in crops]
+
+class EasyOCREngine(OCREngine):
+    name = 'easyocr'
+    target_size = 1024
+
+    def __init__(self, device=True, languages=('en',)):
+        if easyocr is None:
+            raise ImportError("The easyocr engine needs the easyocr package")
+        self.device = device
+        self.languages = list(languages)
+        self.reader = easyocr.Reader(self.languages, gpu=device)
+
+    def detect_batch(self, crops, batch_size=8):
+        if not crops:
+            return []
+        results = self.reader.readtext_batched(pad_crops(crops), batch_size=batch_size)
+        return [(easyocr_boxes(crop_results), easyocr_confidences(crop_results)) for crop_results in results]
+
+    def has_text(self, crops, text_threshold=0.7, batch_size=10):
+        # Detection only, the recognizer is not needed to decide whether a clip contains any text
+        crops = pad_crops(crops) if crops else crops
+        for i in range(0, len(crops), batch_size):
+            horizontal_list_agg, free_list_agg = self.reader.detect(np.stack(crops[i:i + batch_size]), text_threshold=text_threshold, reformat=False)
+            if any(horizontal_list_agg) or any(free_list_agg):
+                return True
+        return False
+
+    def config(self):
+        return dict(super().config(), version=easyocr.__version__, languages=self.languages)
+
+class TesseractEngine(OCREngine):
+    name = 'tesseract'
+
+    def __init__(self, processes=1, backend='auto', tesseract_cmd=None, psm=6):
+        if TesseractPool is None:
+            raise ImportError("The tesseract engine needs the pytesseract package")
+        self.psm = psm
+        self.ocr = TesseractPool(processes, backend, tesseract_cmd)
+
+    def detect_batch(self, crops, batch_size=8):
+        results = self.ocr.image_to_data(crops, psm=self.psm)
+        return [(tesseract_boxes(crop_results), tesseract_confidences(crop_results)) for crop_results in results]
+
+    def has_text(self, crops, text_threshold=0.7, batch_size=10):
+        # Any word with a positive confidence, tesseract has no separate detector threshold
+        return any(any(float(conf) > 0 for conf in results['conf']) for results in self.ocr.image_to_data(crops))
+
+    def config(self):
+        return dict(super().config(), psm=self.psm)
+
+    def close(self):
+        self.ocr.close()
+
+class StubEngine(OCREngine):
+    # Deterministic engine without a model, every crop gets one centred box so decode, inpaint and
+    # encode throughput can be measured without OCR
+    name = 'stub'
+
+    def __init__(self, box_size=(0.6, 0.3)):
+        self.box_size = box_size
+
+    def detect_batch(self, crops, batch_size=8):
+        results = []
+        for crop in crops:
+            height, width = crop.shape[:2]
+            box_width, box_height = self.box_size[0] * width, self.box_size[1] * height
+            if box_width < 1 or box_height < 1:
+                results.append((empty_boxes(), np.zeros(0, dtype=np.float32)))
+                continue
+            x, y = (width - box_width) / 2, (height - box_height) / 2
+            boxes = np.array([[[x, y], [x + box_width, y], [x + box_width, y + box_height], [x, y + box_height]]], dtype=np.float32)
+            results.append((boxes, np.ones(1, dtype=np.float32)))
+        return results
+
+    def has_text(self, crops, text_threshold=0.7, batch_size=10):
+        return bool(crops)
+
+    def config(self):
+        return dict(super().config(), box_size=list(self.box_size))
+
+ENGINES = {'easyocr': EasyOCREngine, 'tesseract': TesseractEngine, 'stub': StubEngine}
+
+def create_engine(name='easyocr', device=True):
+    if name not in ENGINES:
+        raise ValueError(f"Unknown OCR engine '{name}', expected one of {tuple(ENGINES)}")
+    if name == 'easyocr':
+        return EasyOCREngine(device)
+    return ENGINES[name]()
@@ -3,10 +3,13 @@
 #PBS -l walltime=23:00:00
 #PBS -N ocr1
 
-NAMES_DIR="/storage/plzen1/home/valacho/SignLLM/ocr/log_files/ocr_log1.txt"
-LOG_DIR="/storage/plzen1/home/valacho/SignLLM/ocr/filenames/files_timestamps1.csv"
+# Every job appends to its own text-detected log, appends from several NFS clients to one file interleave
+NAMES_DIR="/storage/plzen1/home/valacho/SignLLM/ocr/log_files/ocr_log_${PBS_JOBID}.txt"
+LOG_DIR="/storage/plzen1/home/valacho/SignLLM/ocr/filenames/files_timestamps.csv"
 IN_DIR="/storage/plzen1/home/mhruz/JSALT2024/YouTubeASL/clips_cropped/"
 OUT_DIR="/storage/plzen1/home/mhruz/JSALT2024/YouTubeASL/clips_cropped_ocr/"
+# Shared by every submitted job, each one leases clips from it until the whole list is done
+STATUS_DB="/storage/plzen1/home/valacho/SignLLM/ocr/filenames/files_timestamps.sqlite"
 
 module load mambaforge
 conda activate Trim
@@ -15,4 +18,7 @@ python script_ocr.py \
 	--filenames ${NAMES_DIR} \
 	--logfile ${LOG_DIR} \
 	--input ${IN_DIR} \
-	--output ${OUT_DIR}
\ No newline at end of file
+	--output ${OUT_DIR} \
+	--status_db ${STATUS_DB} \
+	--lease_batch 8 \
+	--profile_report "/storage/plzen1/home/valacho/SignLLM/ocr/profiles/ocr_profile_${PBS_JOBID}.jsonl"
\ No newline at end of file
@@ -0,0 +1,44 @@
+import numpy as np
+import cv2
+
+INPAINT_ALGORITHMS = ('ns', 'telea', 'temporal')
+INPAINT_FLAGS = {'ns': cv2.INPAINT_NS, 'telea': cv2.INPAINT_TELEA}
+
+def mask_rois(mask, margin):
+    # Bounding rectangles of the mask components grown by margin, nearby boxes merge into one ROI
+    kernel = np.ones((2 * margin + 1, 2 * margin + 1), dtype=np.uint8)
+    contours, _ = cv2.findContours(cv2.dilate(mask, kernel), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return [cv2.boundingRect(contour) for contour in contours]
+
+def inpaint_rois(image, mask, radius=3, flags=cv2.INPAINT_NS):
+    result = image.copy()
+    for x, y, w, h in mask_rois(mask, 2 * radius + 1):
+        roi_mask = mask[y:y + h, x:x + w]
+        inpainted = cv2.inpaint(image[y:y + h, x:x + w], roi_mask, inpaintRadius=radius, flags=flags)
+        cv2.copyTo(inpainted, roi_mask, result[y:y + h, x:x + w])
+    return result
+
+def inpaint_full_frame(image, mask, radius=3, flags=cv2.INPAINT_NS):
+    return cv2.inpaint(image, mask, inpaintRadius=radius, flags=flags)
+
+class Inpainter:
+    # Per-clip inpainting, 'temporal' fills the mask from the previous clean output frame and
+    # falls back to NS when there is no previous frame
+    def __init__(self, algorithm='ns', radius=3, roi=True):
+        if algorithm not in INPAINT_ALGORITHMS:
+            raise ValueError(f"Unknown inpainting algorithm '{algorithm}', expected one of {INPAINT_ALGORITHMS}")
+        self.algorithm = algorithm
+        self.radius = radius
+        self.inpaint = inpaint_rois if roi else inpaint_full_frame
+        self.previous = None
+
+    def __call__(self, image, mask):
+        if not mask.any():
+            result = image
+        elif self.algorithm == 'temporal' and self.previous is not None and self.previous.shape == image.shape:
+            result = cv2.copyTo(self.previous, mask, image.copy())
+        else:
+            result = self.inpaint(image, mask, self.radius, INPAINT_FLAGS.get(self.algorithm, cv2.INPAINT_NS))
+        if self.algorithm == 'temporal':
+            self.previous = result
+        return result
@@ -0,0 +1,114 @@
+import time
+import logging
+import numpy as np
+import cv2
+import ffmpeg
+
+def parse_frame_rate(rate):
+    num, _, den = rate.partition('/')
+    return float(num) / float(den) if den and float(den) else float(num)
+
+class MediaHandle:
+    # Probes a clip once and serves both the sampled frames and the full frame stream from a single
+    # in-process decoder instead of opening the file with moviepy once per use. With the metadata of
+    # a media index entry the ffprobe calls are skipped
+    def __init__(self, path, metadata=None):
+        self.path = path
+        self.timings = {}
+        self.keyframe_times = metadata.get('keyframes') if metadata else None
+
+        start = time.time()
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise IOError(f"Cannot open video file {path}")
+        self.timings['open'] = time.time() - start
+
+        if metadata:
+            self.fps = metadata['fps'] or self.cap.get(cv2.CAP_PROP_FPS)
+            self.width, self.height = metadata['width'], metadata['height']
+            self.codec, self.pix_fmt = metadata['codec'], metadata['pix_fmt']
+            self.start_time = metadata['start_time'] or 0.0
+            self.bitrate = metadata['bitrate']
+            self.duration = metadata['duration'] or 0.0
+            self.frame_count = metadata['total_frames']
+            return
+
+        start = time.time()
+        probe = ffmpeg.probe(path)
+        stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), {})
+        rate = stream.get('avg_frame_rate', '0/0')
+        self.fps = parse_frame_rate(rate) if rate != '0/0' else self.cap.get(cv2.CAP_PROP_FPS)
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.codec = stream.get('codec_name')
+        self.pix_fmt = stream.get('pix_fmt')
+        self.start_time = float(stream.get('start_time') or 0)
+        self.bitrate = int(stream['bit_rate']) if stream.get('bit_rate') else None
+        self.duration = float(stream.get('duration') or probe['format'].get('duration') or 0)
+        if stream.get('nb_frames'):
+            self.frame_count = int(stream['nb_frames'])
+        elif self.duration:
+            self.frame_count = int(round(self.duration * self.fps))
+        else:
+            self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.timings['probe'] = time.time() - start
+
+    def sample_frames(self, sample_count=5):
+        start = time.time()
+        frame_indices = np.linspace(0, max(self.frame_count - 1, 0), sample_count, dtype=int)
+
+        frames = []
+        for idx in frame_indices:
+            # Seeks to the closest keyframe and decodes forward to the requested frame
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, int(idx))
+            ret, frame = self.cap.read()
+            if not ret:
+                logging.warning(f"Warning: Unable to get frame at index {idx} from {self.path}")
+                continue
+            frames.append(frame)
+        self.timings['sample'] = time.time() - start
+        return frames
+
+    def iter_frames(self):
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        while True:
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+            yield frame
+
+    def keyframes(self):
+        # (frame index, time) of every keyframe, read from the packet flags without decoding
+        start = time.time()
+        if self.keyframe_times is not None:
+            times = self.keyframe_times
+        else:
+            probe = ffmpeg.probe(self.path, select_streams='v:0', show_entries='packet=pts_time,flags')
+            times = sorted(float(packet['pts_time']) - self.start_time for packet in probe.get('packets', [])
+                           if 'K' in packet.get('flags', '') and packet.get('pts_time', 'N/A') != 'N/A')
+        self.keyframe_times = times
+        keyframes = []
+        for keyframe_time in times:
+            index = int(round(keyframe_time * self.fps))
+            if not keyframes or index > keyframes[-1][0]:
+                keyframes.append((index, keyframe_time))
+        self.timings['keyframes'] = time.time() - start
+        return keyframes
+
+    def metadata(self):
+        # Entry of the media index, in the layout of common.probe.probe_video
+        return {'fps': self.fps, 'width': self.width, 'height': self.height, 'total_frames': self.frame_count, 'source': 'ffmpeg.probe',
+                'duration': self.duration, 'bitrate': self.bitrate, 'codec': self.codec, 'pix_fmt': self.pix_fmt,
+                'start_time': self.start_time, 'keyframes': self.keyframe_times, 'vtt_path': None}
+
+    def startup_time(self):
+        return sum(self.timings.values())
+
+    def close(self):
+        self.cap.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
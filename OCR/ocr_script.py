@@ -1,45 +1,102 @@
 import os
+import sys
 import time
-import re
+import itertools
 import shutil
-import warnings
 import argparse
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 import numpy as np
-import easyocr
 import logging
 import matplotlib.pyplot as plt
-from multiprocessing import current_process
-from threading import Thread
-from queue import Queue
-from moviepy.editor import VideoFileClip
+from multiprocessing import current_process, get_context
+from threading import Thread, Event
+from queue import Queue, Full, Empty
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import socket
+import sqlite3
 import cv2
 import ffmpeg
-
-warnings.filterwarnings("ignore", category=UserWarning, module="moviepy")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from media import MediaHandle
+from segment_writer import EncodeWriter, SegmentWriter, partial_path, remove_output, remove_partials
+from common.prefetch import OutputMover, Prefetcher, prefetched
+from common.media_index import MediaIndex
+from common.encoder import ENCODER_PROFILES, H264_ENCODERS, add_encoder_arguments, can_feed_yuv, encoder_profile_from_args
+from bboxes import boxes_to_mask, scale_boxes, shrink_boxes
+from engines import ENGINES, create_engine
+from detection_cache import ClipDetections, DetectionCache, cache_key
+from inpaint import Inpainter, INPAINT_ALGORITHMS, inpaint_rois
+from profiler import Profiler, ProfileReport
+from text_masks import MaskWriter, masks_path
+from status_store import StatusStore, PROCESSED, NOT_FOUND, ALREADY_EXISTS, NOT_READABLE
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-reader = None
+engine = None
+engine_name = 'easyocr'
+engine_device = True
+detection_cache = None
+media_index = None
 
-def initialize_reader():
-    global reader
-    if reader is None:
-        reader = easyocr.Reader(['en'], gpu=True)
-        logging.info(f"Initialized EasyOCR Reader on process {current_process().name}")
+BANDS = ('upper', 'lower')
+OCR_SCALE_MODES = ('fixed', 'adaptive')
+OUTPUT_MODES = ('video', 'masks')
+# Worker pools in a row that may die before one finishes a clip, beyond it the node rather than the clips is broken
+MAX_FAILED_POOLS = 3
 
-def shrink_bbox(xy, shrink_factor=1):
-    xy1, xy2, xy3, xy4 = xy[0], xy[1], xy[2], xy[3]
-    center_x = (xy1[0] + xy3[0]) / 2
-    center_y = (xy1[1] + xy3[1]) / 2
+def initialize_engine():
+    global engine
+    if engine is None:
+        engine = create_engine(engine_name, engine_device)
+        logging.info(f"Initialized {engine_name} OCR engine on process {current_process().name} (device: {engine_device})")
 
-    new_xy = []
-    for point in [xy1, xy2, xy3, xy4]:
-        new_x = center_x + shrink_factor * (point[0] - center_x)
-        new_y = center_y + shrink_factor * (point[1] - center_y)
-        new_xy.append([int(new_x), int(new_y)])
-    
-    return new_xy
+def use_engine(new_engine):
+    # For callers that configure their own engine instance instead of a name and device
+    global engine, engine_name
+    engine, engine_name = new_engine, new_engine.name
+
+def get_detection_cache(cache_dir, max_bytes):
+    global detection_cache
+    if detection_cache is None or detection_cache.cache_dir != cache_dir:
+        detection_cache = DetectionCache(cache_dir, max_bytes)
+    return detection_cache
+
+def get_media_index(db_path):
+    global media_index
+    if media_index is None or media_index.db_path != db_path:
+        media_index = MediaIndex(db_path)
+    return media_index
+
+def detection_config(ocr_stride, diff_threshold, ocr_scale='fixed', min_text_height=20):
+    # Settings that change which frames are OCRed or what the engine returns for them
+    initialize_engine()
+    config = dict(engine.config(), bands=[0.2, 0.7], ocr_stride=ocr_stride, diff_threshold=diff_threshold, ocr_scale=ocr_scale)
+    if ocr_scale == 'adaptive':
+        config['min_text_height'] = min_text_height
+    return config
+
+def get_devices(gpus=None, name='easyocr'):
+    # Only the easyocr engine runs on GPUs, torch is imported lazily so that the other engines
+    # also run on CPU-only nodes without it
+    if gpus == 'cpu' or name != 'easyocr':
+        return [False]
+    if gpus:
+        return [f'cuda:{gpu.strip()}' for gpu in gpus.split(',')]
+    import torch
+    return [f'cuda:{i}' for i in range(torch.cuda.device_count())] or [False]
+
+def init_worker(device, cpu_threads, name='easyocr'):
+    global engine_device, engine_name
+    engine_device, engine_name = device, name
+    if name == 'easyocr':
+        import torch
+        torch.set_num_threads(cpu_threads)
+    cv2.setNumThreads(cpu_threads)
+
+def init_pool_worker(device_queue, cpu_threads, name='easyocr'):
+    init_worker(device_queue.get(), cpu_threads, name)
+    initialize_engine()
 
 def plot_img(img, results, boxes=True):
     plt.figure()
@@ -56,22 +113,18 @@ def plot_img(img, results, boxes=True):
 
     plt.show()
 
-def inpaint_image_bboxes(image, quadrilaterals):
-    mask = np.zeros(image.shape[:2], dtype=np.uint8)
-    
-    for bbox in quadrilaterals:
-        points = np.array(bbox[0], dtype=np.int32)
-        cv2.fillPoly(mask, [points], 255)
-
-    inpainted_image_ns = cv2.inpaint(image, mask, inpaintRadius=3, flags=cv2.INPAINT_NS)
-    return inpainted_image_ns
+def inpaint_image_bboxes(image, boxes):
+    mask = boxes_to_mask(image.shape, boxes)
+    return inpaint_image_mask(image, mask)
 
 def inpaint_image_mask(image, mask):
-    inpainted_image_ns = cv2.inpaint(image, mask, inpaintRadius=3, flags=cv2.INPAINT_NS)
+    inpainted_image_ns = inpaint_rois(image, mask, radius=3, flags=cv2.INPAINT_NS)
     return inpainted_image_ns
 
 def resize_frame(frame, target_size=1024):
     height, width = frame.shape[:2]
+    if target_size is None:
+        return frame, (1.0, 1.0)
     if height > width:
         new_height = target_size
         new_width = int(width * (target_size / height))
@@ -81,156 +134,503 @@ def resize_frame(frame, target_size=1024):
     resized_frame = cv2.resize(frame, (new_width, new_height))
     return resized_frame, (width / new_width, height / new_height)
 
-def process_frame(frame, original_size):
-    initialize_reader()
-    
-    resized_frame, scale_factors = resize_frame(frame)
-    img_copy = frame.copy()
-    height, width, _ = resized_frame.shape
+def band_crops(resized_frame):
+    height = resized_frame.shape[0]
+    upper_end, lower_start = int(0.2 * height), int(0.7 * height)
+    return {'upper': resized_frame[:upper_end, :], 'lower': resized_frame[lower_start:, :]}, {'upper': 0, 'lower': lower_start}
 
-    frame_gray = cv2.cvtColor(resized_frame, cv2.COLOR_BGR2GRAY)
-    
-    results_upper = reader.readtext(frame_gray[:int(0.2 * height), :])
-    results_lower = reader.readtext(frame_gray[int(0.7 * height):, :])
-    
-    for result in results_lower:
-        for point in result[0]:
-            point[1] += int(0.7 * height)
-    
-    results = results_upper + results_lower
-    
-    for i, res in enumerate(results):
-        xy = res[0]
-        for point in xy:
-            point[0] = int(point[0] * scale_factors[0])
-            point[1] = int(point[1] * scale_factors[1])
-        xys = shrink_bbox(xy, shrink_factor=0.95)
-        results[i][0][:] = xys
-        
-    img_inpainted = inpaint_image_bboxes(img_copy, results)
-    
-    return img_inpainted
+def default_ocr_scale(shape):
+    # Scale of the engine's fixed target size, the longer frame side is resized to target_size
+    if engine.target_size is None:
+        return 1.0
+    return engine.target_size / max(shape[:2])
 
-def sample_frames_for_ocr_check(input_video_path, sample_count=5):
-    try:
-        clip = VideoFileClip(input_video_path)
-    except OSError as e:
-        logging.error(f"Error loading video file {input_video_path}: {e}")
-        return []
-    
-    frame_count = int(clip.fps * clip.duration)
-    frame_indices = np.linspace(0, frame_count - 1, sample_count, dtype=int)
+def scale_crop(crop, scale):
+    if scale == 1.0:
+        return crop, (1.0, 1.0)
+    height, width = crop.shape[:2]
+    new_width, new_height = max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+    return cv2.resize(crop, (new_width, new_height), interpolation=interpolation), (width / new_width, height / new_height)
 
-    frames = []
-    for idx in frame_indices:
-        try:
-            frame = clip.get_frame(idx / clip.fps)
-            frames.append(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
-        except Exception as e:
-            logging.warning(f"Warning: Unable to get frame at index {idx} from {input_video_path}: {e}")
+def detect_text_batched(frames, batch_size=8, frame_bands=None, scale=None):
+    # Bands are cropped at full resolution and only the crops are resized, scale=None uses the
+    # engine's fixed target size
+    initialize_engine()
+    if frame_bands is None:
+        frame_bands = [BANDS] * len(frames)
+
+    crops, targets = [], []
+    for i, (frame, bands) in enumerate(zip(frames, frame_bands)):
+        if not bands:
             continue
+        frame_scale = scale or default_ocr_scale(frame.shape)
+        regions, y_offsets = band_crops(frame)
+        for band in bands:
+            crop, scale_factors = scale_crop(cv2.cvtColor(regions[band], cv2.COLOR_BGR2GRAY), frame_scale)
+            crops.append(crop)
+            targets.append((i, band, y_offsets[band], scale_factors))
+
+    frame_results = [{} for _ in frames]
+    if crops:
+        results = engine.detect_batch(crops, batch_size)
+        for (i, band, y_offset, scale_factors), (boxes, confidences) in zip(targets, results):
+            frame_results[i][band] = (scale_boxes(scale_boxes(boxes, scale_factors), y_offset=y_offset), confidences)
+    return frame_results
+
+def text_heights(frame_results):
+    heights = [boxes[:, :, 1].max(axis=1) - boxes[:, :, 1].min(axis=1)
+               for results in frame_results for boxes, _ in results.values() if len(boxes)]
+    return np.concatenate(heights) if heights else np.zeros(0, dtype=np.float32)
+
+class ScalePolicy:
+    # 'fixed' OCRs every frame at the engine's target size. 'adaptive' starts at that scale and, on the
+    # first OCR call that finds text, picks the smallest scale keeping the small text (10th percentile
+    # of the box heights) min_text_height pixels high. That scale is kept for the rest of the clip and
+    # never exceeds the fixed one
+    def __init__(self, mode='fixed', min_text_height=20, min_scale=0.1):
+        if mode not in OCR_SCALE_MODES:
+            raise ValueError(f"Unknown OCR scale mode '{mode}', expected one of {OCR_SCALE_MODES}")
+        self.mode = mode
+        self.min_text_height = min_text_height
+        self.min_scale = min_scale
+        self.scale = None
+
+    def current(self, shape):
+        return self.scale or default_ocr_scale(shape)
+
+    def update(self, frame_results, shape):
+        if self.mode != 'adaptive' or self.scale is not None:
+            return
+        heights = text_heights(frame_results)
+        if not len(heights):
+            return
+        text_height = float(np.percentile(heights, 10))
+        fixed_scale = default_ocr_scale(shape)
+        self.scale = min(fixed_scale, max(self.min_scale, self.min_text_height / max(text_height, 1.0)))
+        logging.info(f"OCR scale {self.scale:.3f} (fixed {fixed_scale:.3f}) for text height {text_height:.1f}px")
+
+def process_frames(frames, batch_size=8, shrink_factor=0.95):
+    frame_results = detect_text_batched(frames, batch_size)
+    return [inpaint_image_bboxes(frame.copy(), shrink_boxes(np.concatenate([results['upper'][0], results['lower'][0]]), shrink_factor))
+            for frame, results in zip(frames, frame_results)]
+
+def process_frame(frame, original_size):
+    return process_frames([frame])[0]
 
-    return frames
+def band_signatures(frame, width=64):
+    height = max(1, int(frame.shape[0] * width / frame.shape[1]))
+    small = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32)
+    return {'upper': small[:int(0.2 * height), :], 'lower': small[int(0.7 * height):, :]}
 
-def contains_text(frames):
-    initialize_reader()
+class KeyframeTracker:
+    # Runs OCR on a band only every ocr_stride frames or when the band changed since its last OCR,
+    # otherwise reuses the dilated mask of the band's last OCR. OCR results are recorded into
+    # detections, or with replay=True read back from them instead of running OCR. With masks_only=True
+    # the frame masks are returned instead of the inpainted frames
+    def __init__(self, ocr_stride=1, diff_threshold=None, mask_dilation=5, inpainter=None, shrink_factor=0.95,
+                 detections=None, replay=False, profiler=None, scale_policy=None, masks_only=False):
+        self.ocr_stride = ocr_stride
+        self.masks_only = masks_only
+        self.scale_policy = scale_policy or ScalePolicy()
+        self.profiler = profiler or Profiler()
+        self.shrink_factor = shrink_factor
+        self.detections = detections
+        self.replay = replay
+        self.frame_index = 0
+        self.inpainter = inpainter or Inpainter()
+        self.diff_threshold = diff_threshold
+        self.kernel = np.ones((2 * mask_dilation + 1, 2 * mask_dilation + 1), dtype=np.uint8)
+        self.frames_since_ocr = {band: None for band in BANDS}
+        self.signatures = {band: None for band in BANDS}
+        self.masks = {band: None for band in BANDS}
+        self.propagated_masks = {band: None for band in BANDS}
+        self.ocr_calls = 0
+        self.skipped_calls = 0
+
+    def bands_to_ocr(self, frame):
+        signatures = band_signatures(frame) if self.diff_threshold is not None else None
+        bands = []
+        for band in BANDS:
+            since = self.frames_since_ocr[band]
+            if since is None or (self.ocr_stride > 0 and since + 1 >= self.ocr_stride):
+                changed = True
+            elif signatures is not None:
+                changed = np.mean(np.abs(signatures[band] - self.signatures[band])) > self.diff_threshold
+            else:
+                changed = False
+
+            if changed:
+                bands.append(band)
+                self.frames_since_ocr[band] = 0
+                if signatures is not None:
+                    self.signatures[band] = signatures[band]
+            else:
+                self.frames_since_ocr[band] += 1
+        return bands
+
+    def process(self, frames, batch_size=8):
+        frame_indices = range(self.frame_index, self.frame_index + len(frames))
+        self.frame_index += len(frames)
+        self.profiler.frames += len(frames)
+        ocr_start = time.perf_counter()
+        if self.replay:
+            frame_results = [{band: self.detections.get(index, band) for band in self.detections.frame_bands(index)}
+                             for index in frame_indices]
+        else:
+            frame_bands = [self.bands_to_ocr(frame) for frame in frames]
+            frame_results = detect_text_batched(frames, batch_size, frame_bands, self.scale_policy.current(frames[0].shape))
+            self.scale_policy.update(frame_results, frames[0].shape)
+            if self.detections is not None:
+                for index, results in zip(frame_indices, frame_results):
+                    for band, (boxes, confidences) in results.items():
+                        self.detections.add(index, band, boxes, confidences)
+        self.profiler.add('ocr', time.perf_counter() - ocr_start)
+
+        inpaint_start = time.perf_counter()
+        processed_frames = []
+        for frame, results in zip(frames, frame_results):
+            mask = None
+            for band in BANDS:
+                if band in results:
+                    band_mask = self.masks[band] = boxes_to_mask(frame.shape, shrink_boxes(results[band][0], self.shrink_factor))
+                    self.propagated_masks[band] = None
+                    self.ocr_calls += 1
+                else:
+                    if self.masks[band] is None:
+                        self.masks[band] = np.zeros(frame.shape[:2], dtype=np.uint8)
+                    if self.propagated_masks[band] is None:
+                        self.propagated_masks[band] = cv2.dilate(self.masks[band], self.kernel)
+                    band_mask = self.propagated_masks[band]
+                    self.skipped_calls += 1
+                mask = band_mask if mask is None else cv2.bitwise_or(mask, band_mask)
+            touched = bool(mask.any())
+            processed_frames.append((mask if self.masks_only else self.inpainter(frame, mask), touched))
+        self.profiler.add('inpaint', time.perf_counter() - inpaint_start)
+        return processed_frames
+
+def edge_density(image):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    return np.count_nonzero(cv2.Canny(gray, 100, 200)) / gray.size
+
+def contains_text(frames, text_threshold=0.7, batch_size=10, min_edge_density=0.0):
+    initialize_engine()
+    crops = []
     for frame in frames:
-        resized_frame, _ = resize_frame(frame)
-        height, width, _ = resized_frame.shape
-        upper_region = resized_frame[:int(0.2 * height), :]
-        lower_region = resized_frame[int(0.7 * height):, :]
-        
-        results_upper = reader.readtext(upper_region)
-        results_lower = reader.readtext(lower_region)
-        
-        if results_upper or results_lower:
+        resized_frame, _ = resize_frame(frame, engine.target_size)
+        regions, _ = band_crops(resized_frame)
+        crops.extend(regions[band] for band in BANDS)
+
+    if min_edge_density > 0:
+        # Flat crops without strokes cannot contain text, skip them before running the detector
+        crops = [crop for crop in crops if edge_density(crop) >= min_edge_density]
+
+    return engine.has_text(crops, text_threshold, batch_size)
+
+def put_or_stop(queue, item, stop_event):
+    while not stop_event.is_set():
+        try:
+            queue.put(item, timeout=0.1)
             return True
+        except Full:
+            continue
     return False
 
-def load_video(input_video_path, queue):
-    clip = VideoFileClip(input_video_path)
-    frames = [cv2.cvtColor(frame, cv2.COLOR_RGB2BGR) for frame in clip.iter_frames()]
-    queue.put(frames)
+def get_or_stop(queue, stop_event):
+    while not stop_event.is_set():
+        try:
+            return queue.get(timeout=0.1)
+        except Empty:
+            continue
+    return None
 
-def get_video_bitrate(input_video_path):
-    probe = ffmpeg.probe(input_video_path)
-    bitrate = next((stream['bit_rate'] for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
-    return int(bitrate) if bitrate else None
+def decode_frames(media, frame_queue, stop_event, errors, profiler):
+    try:
+        frames = media.iter_frames()
+        while True:
+            with profiler.timer('decode'):
+                frame = next(frames, None)
+            if frame is None or not put_or_stop(frame_queue, frame, stop_event):
+                break
+    except Exception as e:
+        errors.append(e)
+        stop_event.set()
+    finally:
+        put_or_stop(frame_queue, None, stop_event)
 
-def update_line(file_path, filename, new_number):
+def inpaint_frames(frame_queue, output_queue, stop_event, errors, tracker, batch_size=8):
     try:
-        # Read the CSV file
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-        
-        # Regular expression to match a comma followed by any number
-        pattern = re.compile(r',\d+')
-        
-        # Find and update the specific line
-        for i, line in enumerate(lines):
-            if filename in line:
-                lines[i] = pattern.sub(f',{new_number}', line)
+        batch = []
+        while True:
+            frame = get_or_stop(frame_queue, stop_event)
+            if frame is not None:
+                batch.append(frame)
+            if batch and (frame is None or len(batch) == batch_size):
+                for processed in tracker.process(batch, batch_size):
+                    if not put_or_stop(output_queue, processed, stop_event):
+                        return
+                batch = []
+            if frame is None:
                 break
-        else:
-            print(f"Error: The filename '{filename}' was not found in the CSV file.")
-            return
-        
-        # Write the updated lines back to the CSV file
-        with open(file_path, 'w') as file:
-            file.writelines(lines)
-        
-    except FileNotFoundError:
-        print(f"Error: The file '{file_path}' was not found.")
     except Exception as e:
-        print(f"An error occurred: {e}")
+        errors.append(e)
+        stop_event.set()
+    finally:
+        put_or_stop(output_queue, None, stop_event)
 
-def process_video(input_video_path, output_video_path, log_file_path, file_ocred_log):
+def process_video(input_video_path, output_video_path, queue_size=32, batch_size=8, ocr_stride=1, diff_threshold=None, mask_dilation=5,
+                  sample_count=5, text_threshold=0.7, min_edge_density=0.0, inpaint_algorithm='ns', inpaint_radius=3, roi_inpaint=True,
+                  shrink_factor=0.95, detection_cache_dir=None, cache_size_gb=10, reuse_detections=False, segment_copy=True, max_gop_buffer=128,
+                  encoder_profile=None, feed_yuv=False, ocr_scale='fixed', min_text_height=20, output_mode='video', media_index_path=None, source_path=None, profiler=None):
+    # source_path is the original of a prefetched input_video_path, the media index is keyed by it
+    profiler = profiler or Profiler()
     if not os.access(input_video_path, os.R_OK):
         print(f"Error: The file '{input_video_path}' is not readable.")
-        update_line(log_file_path, input_video_path[-29:], 4)
-        return
+        return NOT_READABLE, None
 
-    sample_frames = sample_frames_for_ocr_check(input_video_path)
-    text_detected = contains_text(sample_frames)
-    update_line(log_file_path, input_video_path[-29:], 1)
-    
-    if not text_detected:
-        with open(file_ocred_log, 'a') as file:
-            file.write(str(input_video_path[-29:])+(', ')+str(False)+"\n")
-        shutil.copy(input_video_path, output_video_path)
-        logging.info(f"No text detected in video: {input_video_path}. Skipping processing.")
-        return
+    index = get_media_index(media_index_path) if media_index_path else None
+    metadata = index.lookup(source_path or input_video_path) if index else None
+    try:
+        media = MediaHandle(input_video_path, metadata)
+    except (IOError, ffmpeg.Error) as e:
+        logging.error(f"Error loading video file {input_video_path}: {e}")
+        return NOT_READABLE, None
+
+    with media:
+        try:
+            with profiler.timer('cache'):
+                cache = get_detection_cache(detection_cache_dir, int(cache_size_gb * 1024 ** 3)) if detection_cache_dir else None
+                key = cache_key(input_video_path, detection_config(ocr_stride, diff_threshold, ocr_scale, min_text_height)) if cache else None
+                cached = cache.load(key, BANDS) if cache and reuse_detections else None
+
+            if cached is not None:
+                # Only clips with text are cached, sampling and OCR are both skipped
+                logging.info(f"Reusing cached detections {key} for video: {input_video_path}")
+            else:
+                sample_frames = media.sample_frames(sample_count)
+                with profiler.timer('contains_text'):
+                    text_detected = contains_text(sample_frames, text_threshold, 2 * batch_size, min_edge_density)
+                timings = ', '.join(f"{stage} {duration:.3f}s" for stage, duration in media.timings.items())
+                logging.info(f"Media startup {media.startup_time():.3f}s ({timings}) for video: {input_video_path}")
+
+                if not text_detected:
+                    if output_mode == 'masks':
+                        writer = MaskWriter(output_video_path, media.width, media.height, text_detected=False)
+                        writer.write_empty(media.frame_count)
+                        writer.close()
+                    else:
+                        with profiler.timer('copy'):
+                            shutil.copy(input_video_path, partial_path(output_video_path))
+                            os.replace(partial_path(output_video_path), output_video_path)
+                    logging.info(f"No text detected in video: {input_video_path}. Skipping processing.")
+                    return PROCESSED, False
+
+            inpainter = Inpainter(inpaint_algorithm, inpaint_radius, roi_inpaint)
+            detections = cached if cached is not None else (ClipDetections(BANDS) if cache else None)
+            tracker = KeyframeTracker(ocr_stride, diff_threshold, mask_dilation, inpainter, shrink_factor, detections,
+                                      replay=cached is not None, profiler=profiler, scale_policy=ScalePolicy(ocr_scale, min_text_height),
+                                      masks_only=output_mode == 'masks')
+            inpaint_video(media, output_video_path, tracker, queue_size, batch_size, segment_copy, max_gop_buffer, encoder_profile, feed_yuv)
+
+            if cache and cached is None:
+                with profiler.timer('cache'):
+                    cache.save(key, detections)
+            return PROCESSED, True
+        finally:
+            # open, probe, sample and keyframes are timed by the media handle itself
+            for stage, duration in media.timings.items():
+                profiler.add(stage, duration)
+            if index is not None and (metadata is None or (metadata['keyframes'] is None and media.keyframe_times is not None)):
+                try:
+                    index.store(source_path or input_video_path, dict(media.metadata(), vtt_path=metadata['vtt_path'] if metadata else None))
+                except sqlite3.OperationalError as e:
+                    logging.warning(f"Media index update failed for video {input_video_path}: {e}")
+
+def open_writer(media, output_video_path, segment_copy=True, max_gop_buffer=128, encoder_profile=None, feed_yuv=False):
+    encoder_profile = encoder_profile or ENCODER_PROFILES['default']
+    if feed_yuv and not can_feed_yuv(media.width, media.height):
+        logging.warning(f"Odd frame size {media.width}x{media.height}, feeding bgr24 to the encoder for video: {media.path}")
+        feed_yuv = False
+
+    # Stream-copying untouched GOPs needs an H.264 yuv420p source that starts on a keyframe,
+    # the encoded segments are concatenated with the copied ones without re-encoding them
+    if segment_copy and media.codec == 'h264' and media.pix_fmt == 'yuv420p' and encoder_profile.codec in H264_ENCODERS:
+        keyframes = media.keyframes()
+        if keyframes and keyframes[0][0] == 0:
+            return SegmentWriter(media, output_video_path, keyframes, max_gop_buffer, encoder_profile, feed_yuv)
+    return EncodeWriter(media, output_video_path, encoder_profile, feed_yuv)
+
+def inpaint_video(media, output_video_path, tracker, queue_size=32, batch_size=8, segment_copy=True, max_gop_buffer=128,
+                  encoder_profile=None, feed_yuv=False):
+    if tracker.masks_only:
+        writer = MaskWriter(output_video_path, media.width, media.height)
     else:
+        writer = open_writer(media, output_video_path, segment_copy, max_gop_buffer, encoder_profile, feed_yuv)
+
+    # Decode, OCR/inpaint and encode run concurrently, bounded queues keep only
+    # queue_size frames per stage in memory instead of the whole clip
+    frame_queue = Queue(maxsize=queue_size)
+    output_queue = Queue(maxsize=queue_size)
+    stop_event = Event()
+    errors = []
+    decode_thread = Thread(target=decode_frames, args=(media, frame_queue, stop_event, errors, tracker.profiler), daemon=True)
+    inpaint_thread = Thread(target=inpaint_frames, args=(frame_queue, output_queue, stop_event, errors, tracker, batch_size), daemon=True)
+    decode_thread.start()
+    inpaint_thread.start()
+
+    try:
+        while True:
+            processed = get_or_stop(output_queue, stop_event)
+            if processed is None:
+                break
+            with tracker.profiler.timer('encode'):
+                writer.write(*processed)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        stop_event.set()
+        decode_thread.join()
+        inpaint_thread.join()
+        if errors:
+            writer.abort()
+        else:
+            with tracker.profiler.timer('finalize'):
+                writer.close()
+
+    if errors:
+        raise errors[0]
+
+    total_calls = tracker.ocr_calls + tracker.skipped_calls
+    logging.info(f"{'Cached OCR' if tracker.replay else 'OCR'} run on {tracker.ocr_calls}/{total_calls} frame bands, skipped {tracker.skipped_calls} OCR calls in video: {media.path}")
+
+def run_clip(task):
+    clip_name, input_video_path, output_video_path, options = task
+    profiler = Profiler()
+    try:
+        status, text_detected = process_video(input_video_path, output_video_path, profiler=profiler, **options)
+    except Exception as e:
+        logging.error(f"Error processing video file {input_video_path}: {e}")
+        # The clip stays pending, an output left behind would be counted as ALREADY_EXISTS next time
+        remove_output(output_video_path)
+        status, text_detected = 0, None
+    profile = profiler.record(gpu=bool(engine_device) and engine_name == 'easyocr', clip=clip_name, status=status,
+                              text_detected=text_detected, engine=engine_name, device=str(engine_device))
+    return clip_name, output_video_path, status, text_detected, profile
+
+def record_result(result, store, file_ocred_log, report=None):
+    # Log files are only written by the coordinating process
+    clip_name, output_video_path, status, text_detected, profile = result
+    start = time.perf_counter()
+    if text_detected is not None:
         with open(file_ocred_log, 'a') as file:
-            file.write(str(input_video_path[-29:])+(', ')+str(True)+"\n")
-
-    queue = Queue()
-    load_thread = Thread(target=load_video, args=(input_video_path, queue))
-    load_thread.start()
-    load_thread.join()
-    frames = queue.get()
-
-    clip = VideoFileClip(input_video_path)
-    fps = clip.fps
-    frame_height, frame_width = frames[0].shape[:2]
-    bitrate = get_video_bitrate(input_video_path)
-
-    # Write frames to pipe using ffmpeg
-    process = (
-        ffmpeg
-        .input('pipe:', format='rawvideo', pix_fmt='bgr24', s='{}x{}'.format(frame_width, frame_height), framerate=fps)
-        .output(output_video_path, pix_fmt='yuv420p', video_bitrate=bitrate, an=None)  # an=None removes the audio
-        .overwrite_output()
-        .global_args('-loglevel', 'quiet')  # Suppress ffmpeg console output
-        .run_async(pipe_stdin=True)
-    )
-    
-    for frame in frames:
-        processed_frame = process_frame(frame, (frame_width, frame_height))
-        process.stdin.write(processed_frame.tobytes())
-    
-    process.stdin.close()
-    process.wait()
+            file.write(str(clip_name)+(', ')+str(text_detected)+"\n")
+    if status:
+        store.update(clip_name, status)
+    if status == PROCESSED:
+        print(f'Finished with segment: {output_video_path}')
+        os.chmod(output_video_path, 0o0777)
+    if report is not None:
+        profile['stages']['log_update'] = round(time.perf_counter() - start, 4)
+        report.write(profile)
+
+def make_task(store, filename, input_dir, output_dir, options):
+    input_video_path = os.path.join(input_dir, filename)
+    if options.get('output_mode') == 'masks':
+        output_video_path = masks_path(output_dir, filename)
+    else:
+        output_video_path = os.path.join(output_dir, '{}'.format(filename))
+    if os.path.exists(output_video_path):
+        store.update(filename, ALREADY_EXISTS)
+        return None
+    if not os.path.exists(input_video_path):
+        store.update(filename, NOT_FOUND)
+        logging.error(f"Error loading video file {input_video_path}")
+        return None
+    return filename, input_video_path, output_video_path, options
+
+def leased_tasks(store, owner, lease_batch, lease_seconds, input_dir, output_dir, options):
+    # Leases small batches of pending clips from the shared store until no job has work left to give
+    while True:
+        names = store.lease(owner, lease_batch, lease_seconds)
+        if not names:
+            return
+        logging.info(f"Leased {len(names)} clips for {owner}")
+        for filename in names:
+            task = make_task(store, filename, input_dir, output_dir, options)
+            if task is not None:
+                yield task
+
+class LeaseHeartbeat:
+    # Renews the leases of a job every interval seconds on its own connection to the store
+    def __init__(self, db_path, owner, lease_seconds, interval):
+        self.stop_event = Event()
+        self.thread = Thread(target=self.run, args=(db_path, owner, lease_seconds, interval), daemon=True)
+        self.thread.start()
+
+    def run(self, db_path, owner, lease_seconds, interval):
+        store = StatusStore(db_path, wal=False)
+        try:
+            while not self.stop_event.wait(interval):
+                try:
+                    store.renew(owner, lease_seconds)
+                except sqlite3.OperationalError as e:
+                    logging.warning(f"Renewing the leases of {owner} failed: {e}")
+        finally:
+            store.close()
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
+
+class ClipStaging:
+    # Inputs of the next clips are prefetched to local scratch and finished outputs are moved back in
+    # the background. A clip's status is only recorded once its output is in the output folder
+    def __init__(self, scratch_dir, max_bytes, lookahead=4):
+        self.prefetcher = Prefetcher(os.path.join(scratch_dir, 'inputs'), max_bytes)
+        self.mover = OutputMover()
+        self.output_dir = os.path.join(scratch_dir, 'outputs')
+        self.lookahead = lookahead
+        self.clips = {}
+        self.ready = []
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def tasks(self, tasks):
+        for (clip_name, input_video_path, output_video_path, options), local_input in prefetched(tasks, self.prefetcher, lambda task: task[1], self.lookahead):
+            self.clips[clip_name] = (input_video_path, output_video_path)
+            yield clip_name, local_input, os.path.join(self.output_dir, os.path.basename(output_video_path)), dict(options, source_path=input_video_path)
+
+    def finish(self, result):
+        clip_name, local_output, status, text_detected, profile = result
+        input_video_path, output_video_path = self.clips.pop(clip_name)
+        self.prefetcher.release(input_video_path)
+        result = (clip_name, output_video_path, status, text_detected, profile)
+        if status == PROCESSED and os.path.exists(local_output):
+            self.mover.move(local_output, output_video_path, result)
+        else:
+            self.ready.append(result)
+        return self.drain()
+
+    def drain(self, wait=False):
+        # Results whose outputs were moved, a clip whose move failed stays pending for the next run
+        results, self.ready = self.ready, []
+        for result, error in self.mover.finished(wait):
+            if error is None:
+                results.append(result)
+            else:
+                logging.error(f"Moving the output of {result[0]} to {result[1]} failed: {error}")
+        return results
+
+    def abandon(self, clip_name):
+        # Clip of a worker that died, its prefetched input is dropped and no output is moved back
+        input_video_path, _ = self.clips.pop(clip_name)
+        self.prefetcher.release(input_video_path)
+
+    def close(self):
+        results = self.drain(wait=True)
+        self.prefetcher.close()
+        self.mover.close()
+        return results
 
 def main(args):
     file_ocred_log = args.filenames
@@ -241,23 +641,131 @@ def main(args):
     if not os.path.exists(PATH_output):
         os.makedirs(PATH_output, exist_ok=True)
         
-    with open(log_file_path, mode='r', encoding='utf-8') as infile:
-        for filename in infile:
-            filename = filename.strip()
-            filename = filename[:-2]
-            input_video_path = os.path.join(PATH_input, filename)
-            output_video_path = os.path.join(PATH_output, '{}'.format(filename))
-            if os.path.exists(output_video_path):
-                update_line(log_file_path, input_video_path[-29:], 3)
-                continue
-            if not os.path.exists(input_video_path):
-                update_line(log_file_path, input_video_path[-29:], 2)
-                logging.error(f"Error loading video file {input_video_path}")
-                continue
-            else:
-                process_video(input_video_path, output_video_path, log_file_path, file_ocred_log)
-                print(f'Finished with segment: {output_video_path}')
-                os.chmod(output_video_path, 0o0777)
+    options = dict(queue_size=args.queue_size, batch_size=args.batch_size, ocr_stride=args.ocr_stride,
+                   diff_threshold=args.diff_threshold, mask_dilation=args.mask_dilation, sample_count=args.sample_count,
+                   text_threshold=args.text_threshold, min_edge_density=args.min_edge_density, inpaint_algorithm=args.inpaint_algorithm,
+                   inpaint_radius=args.inpaint_radius, roi_inpaint=not args.full_frame_inpaint, shrink_factor=args.shrink_factor,
+                   detection_cache_dir=args.detection_cache, cache_size_gb=args.cache_size_gb, reuse_detections=args.reuse_detections,
+                   segment_copy=not args.full_reencode, max_gop_buffer=args.max_gop_buffer,
+                   encoder_profile=encoder_profile_from_args(args), feed_yuv=args.feed_yuv, ocr_scale=args.ocr_scale,
+                   min_text_height=args.min_text_height, output_mode=args.output_mode, media_index_path=args.media_index)
+
+    # A leased queue is shared by jobs on several hosts, the WAL journal only works within one host
+    store = StatusStore(args.status_db or f"{log_file_path}.sqlite", wal=not args.lease_batch)
+    report = ProfileReport(args.profile_report) if args.profile_report else None
+    store.import_csv(log_file_path)
+
+    owner = f"{socket.gethostname()}:{os.environ.get('PBS_JOBID', '')}:{os.getpid()}"
+    if args.lease_batch:
+        tasks = leased_tasks(store, owner, args.lease_batch, args.lease_seconds, PATH_input, PATH_output, options)
+    else:
+        tasks = [make_task(store, filename, PATH_input, PATH_output, options) for filename in store.pending()]
+        tasks = [task for task in tasks if task is not None]
+    heartbeat = args.lease_seconds / 3
+
+    staging = ClipStaging(args.scratch_dir, int(args.scratch_gb * 1024 ** 3), args.prefetch) if args.scratch_dir else None
+    if staging is not None:
+        tasks = staging.tasks(tasks)
+
+    def handle_result(result):
+        for ready in (staging.finish(result) if staging is not None else [result]):
+            record_result(ready, store, file_ocred_log, report)
+
+    def handle_crash(task):
+        # The clip killed its worker, it counts an attempt and goes back to the queue
+        clip_name, _, output_video_path, _ = task
+        logging.error(f"A worker process died on {clip_name}")
+        if staging is not None:
+            staging.abandon(clip_name)
+        remove_output(output_video_path)
+        remove_partials(output_video_path)
+        if store.fail(clip_name, args.max_attempts) == NOT_READABLE:
+            logging.error(f"Workers died on {clip_name} {args.max_attempts} times, marking it as not readable")
+
+    devices = get_devices(args.gpus, args.engine)
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    cpu_threads = max(1, cpus // args.workers)
+
+    try:
+        if args.workers > 1:
+            # Each worker owns one OCR engine pinned to a device. Only a window of clips is submitted
+            # at a time so that leased clips are taken from the queue as the workers free up. A worker
+            # killed by the OS (OOM, CUDA crash) breaks the pool, the job then goes on with a new pool
+            ctx = get_context('spawn')
+            tasks = iter(tasks)
+            # Clips in flight when a worker died, rerun one at a time so that a crash is blamed on one clip
+            suspects = []
+            failed_pools = 0
+            while True:
+                device_queue = ctx.Queue()
+                for i in range(args.workers):
+                    device_queue.put(devices[i % len(devices)])
+                with ProcessPoolExecutor(args.workers, mp_context=ctx, initializer=init_pool_worker,
+                                         initargs=(device_queue, cpu_threads, args.engine)) as pool:
+                    futures = {}
+                    broken = False
+                    while not broken:
+                        if suspects:
+                            if not futures:
+                                task = suspects.pop(0)
+                                futures[pool.submit(run_clip, task)] = task
+                        else:
+                            while len(futures) < 2 * args.workers and (task := next(tasks, None)) is not None:
+                                futures[pool.submit(run_clip, task)] = task
+                        if not futures:
+                            break
+                        done, _ = wait(futures, timeout=heartbeat, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            try:
+                                result = future.result()
+                            except BrokenProcessPool:
+                                broken = True
+                                continue
+                            del futures[future]
+                            handle_result(result)
+                            failed_pools = 0
+                        if args.lease_batch:
+                            store.renew(owner, args.lease_seconds)
+                if not broken:
+                    break
+
+                crashed = []
+                for future, task in futures.items():
+                    try:
+                        handle_result(future.result())
+                    except BrokenProcessPool:
+                        crashed.append(task)
+                failed_pools += 1
+                if failed_pools > MAX_FAILED_POOLS:
+                    raise BrokenProcessPool(f"{failed_pools} worker pools in a row died without finishing a clip")
+                if len(crashed) == 1:
+                    handle_crash(crashed[0])
+                else:
+                    logging.error(f"A worker process died with {len(crashed)} clips in flight, rerunning them one at a time")
+                    suspects.extend(crashed)
+        else:
+            init_worker(devices[0], cpu_threads, args.engine)
+            # Clips run in this thread, the leases are renewed in the background while one is processed
+            heartbeat_thread = LeaseHeartbeat(store.db_path, owner, args.lease_seconds, heartbeat) if args.lease_batch else None
+            try:
+                for task in tasks:
+                    handle_result(run_clip(task))
+            finally:
+                if heartbeat_thread is not None:
+                    heartbeat_thread.close()
+    finally:
+        if staging is not None:
+            for ready in staging.close():
+                record_result(ready, store, file_ocred_log, report)
+        if args.lease_batch:
+            store.release(owner)
+
+    if not args.lease_batch:
+        # A shared store holds the clips of every job, it is only exported by a job processing the whole list alone
+        store.export_csv(log_file_path)
+    store.close()
+    if report is not None:
+        report.close(workers=args.workers, engine=args.engine, cpus=cpus, gpus=len([device for device in devices if device]))
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Process videos with OCR")
@@ -265,6 +773,40 @@ if __name__ == '__main__':
     parser.add_argument('--logfile', type=str, required=True, help="Output logfile")
     parser.add_argument('--input', type=str, required=True, help="Path to the input video folder")
     parser.add_argument('--output', type=str, required=True, help="Path to the output video folder")
+    parser.add_argument('--output_mode', type=str, default='video', choices=OUTPUT_MODES, help="'video' writes inpainted clips, 'masks' only writes the per-frame text masks of each clip to <clip>.masks.npz without inpainting or encoding")
+    parser.add_argument('--queue_size', type=int, default=32, help="Maximum number of frames buffered between the decode, inpaint and encode stages")
+    parser.add_argument('--batch_size', type=int, default=8, help="Number of frames whose upper and lower bands are OCRed in one EasyOCR batch")
+    parser.add_argument('--ocr_stride', type=int, default=1, help="Run OCR on each band at least every N-th frame and reuse its last mask in between, 0 disables forced OCR")
+    parser.add_argument('--diff_threshold', type=float, default=None, help="Also re-run OCR on a band when its mean absolute difference to the band at its last OCR exceeds this value (0-255)")
+    parser.add_argument('--mask_dilation', type=int, default=5, help="Dilation in pixels applied to band masks reused between OCR runs")
+    parser.add_argument('--ocr_scale', type=str, default='fixed', choices=OCR_SCALE_MODES, help="'fixed' OCRs at the engine's target size, 'adaptive' picks the smallest scale per clip that keeps the text --min_text_height pixels high")
+    parser.add_argument('--min_text_height', type=float, default=20, help="Text height in pixels the adaptive OCR scale keeps")
+    parser.add_argument('--sample_count', type=int, default=5, help="Number of frames sampled to decide whether a clip contains text")
+    parser.add_argument('--text_threshold', type=float, default=0.7, help="Text confidence threshold of the detector used on the sampled frames")
+    parser.add_argument('--min_edge_density', type=float, default=0.0, help="Skip sampled band crops with a lower fraction of Canny edge pixels before detection, 0 disables the pre-filter")
+    parser.add_argument('--inpaint_algorithm', type=str, default='ns', choices=INPAINT_ALGORITHMS, help="Inpainting algorithm, 'temporal' fills the mask from the previous clean frame")
+    parser.add_argument('--inpaint_radius', type=int, default=3, help="Inpainting radius in pixels")
+    parser.add_argument('--full_frame_inpaint', action='store_true', help="Inpaint the whole frame instead of only the mask regions")
+    parser.add_argument('--shrink_factor', type=float, default=0.95, help="Factor the detected boxes are shrunk by around their centre before inpainting")
+    parser.add_argument('--detection_cache', type=str, default=None, help="Directory of the per-clip OCR detection cache, detections are written there when set")
+    parser.add_argument('--cache_size_gb', type=float, default=10, help="Size budget of the detection cache, least recently used entries are evicted above it")
+    parser.add_argument('--reuse_detections', action='store_true', help="Replay cached detections instead of running OCR, only inpainting and encoding are redone")
+    parser.add_argument('--full_reencode', action='store_true', help="Re-encode every frame instead of stream-copying the GOPs without inpainted frames")
+    parser.add_argument('--max_gop_buffer', type=int, default=128, help="Untouched frames of a GOP held back before the GOP is re-encoded anyway")
+    add_encoder_arguments(parser)
+    parser.add_argument('--feed_yuv', action='store_true', help="Convert frames to yuv420p with OpenCV before piping them, ffmpeg then skips its bgr24 conversion")
+    parser.add_argument('--engine', type=str, default='easyocr', choices=tuple(ENGINES), help="OCR engine, 'stub' returns fixed boxes without a model to benchmark decode, inpaint and encode")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker processes, each owning one OCR engine")
+    parser.add_argument('--gpus', type=str, default=None, help="Comma separated GPU ids to spread workers over, 'cpu' to run on CPU only (default: all visible GPUs)")
+    parser.add_argument('--profile_report', type=str, default=None, help="JSONL file receiving per-clip stage timings, frames/s, GPU idle fraction and peak RSS, plus a job summary")
+    parser.add_argument('--media_index', type=str, default=None, help="SQLite media index of the clips (see common/media_index.py), probing is skipped for indexed clips and new ones are added")
+    parser.add_argument('--scratch_dir', type=str, default=None, help="Local scratch folder, the next clips are prefetched into it and outputs are moved from it to --output in the background")
+    parser.add_argument('--scratch_gb', type=float, default=20, help="Size budget of the prefetched inputs in the scratch folder")
+    parser.add_argument('--prefetch', type=int, default=4, help="Number of upcoming clips prefetched while the current ones are processed")
+    parser.add_argument('--lease_batch', type=int, default=0, help="Lease clips in batches of this size from the status store shared by all jobs, 0 processes the whole list alone")
+    parser.add_argument('--max_attempts', type=int, default=3, help="Number of worker crashes on a clip after which it is marked as not readable instead of being retried")
+    parser.add_argument('--lease_seconds', type=float, default=1800, help="Lease duration, the clips of a job that stops renewing its leases are handed to the other jobs after it")
+    parser.add_argument('--status_db', type=str, default=None, help="SQLite status store of the logfile, resumed from on restart (default: <logfile>.sqlite)")
     args = parser.parse_args()
     
     start = time.time()
@@ -0,0 +1,86 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def peak_rss_mb():
+    # Peak resident set size of the calling process, ru_maxrss is in kilobytes on Linux
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+class Profiler:
+    # Wall time accumulated per pipeline stage of one clip. The decode, OCR/inpaint and encode stages
+    # run in their own threads, so their sum can exceed the wall time of the clip
+    def __init__(self):
+        self.stages = {}
+        self.frames = 0
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def record(self, gpu=False, **fields):
+        wall = time.perf_counter() - self.start
+        record = dict(fields, wall=round(wall, 4), frames=self.frames, fps=round(self.frames / wall, 2) if wall else None,
+                      stages={stage: round(seconds, 4) for stage, seconds in self.stages.items()})
+        # The GPU only works inside the OCR calls, everything else of the clip leaves it idle
+        record['gpu_idle_fraction'] = round(max(0.0, 1 - self.stages.get('ocr', 0.0) / wall), 4) if gpu and wall else None
+        record['peak_rss_mb'] = peak_rss_mb()
+        record['pid'] = os.getpid()
+        return record
+
+class ProfileReport:
+    # One JSON line per clip and a closing job summary, written only by the coordinating process
+    def __init__(self, path, job_id=None):
+        self.path = path
+        self.job_id = job_id or os.environ.get('PBS_JOBID')
+        self.start = time.perf_counter()
+        self.clips = 0
+        self.frames = 0
+        self.stages = {}
+        self.peak_rss_mb = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, 'a')
+
+    def write(self, record):
+        record = dict(record, type='clip', job_id=self.job_id)
+        self.clips += 1
+        self.frames += record.get('frames', 0)
+        for stage, seconds in record.get('stages', {}).items():
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        if record.get('peak_rss_mb') is not None:
+            self.peak_rss_mb = max(self.peak_rss_mb or 0, record['peak_rss_mb'])
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self, **fields):
+        wall = time.perf_counter() - self.start
+        summary = dict(fields, type='job', job_id=self.job_id, wall=round(wall, 2), clips=self.clips, frames=self.frames,
+                       fps=round(self.frames / wall, 2) if wall else None, peak_rss_mb=self.peak_rss_mb,
+                       stages={stage: round(seconds, 2) for stage, seconds in sorted(self.stages.items(), key=lambda item: -item[1])})
+        self.file.write(json.dumps(summary) + '\n')
+        self.file.close()
+
+        stages = ', '.join(f"{stage} {seconds:.1f}s" for stage, seconds in summary['stages'].items())
+        logging.info(f"Profiled {self.clips} clips, {self.frames} frames at {summary['fps']} frames/s in {wall:.1f}s ({stages})")
+        return summary
@@ -0,0 +1,190 @@
+import os
+import sys
+import glob
+import shutil
+import logging
+import tempfile
+import ffmpeg
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.encoder import ENCODER_PROFILES, frame_bytes
+
+def start_encoder(output_path, width, height, fps, bitrate, profile=None, feed_yuv=False, **output_args):
+    profile = profile or ENCODER_PROFILES['default']
+    return (
+        ffmpeg
+        .input('pipe:', format='rawvideo', pix_fmt='yuv420p' if feed_yuv else 'bgr24', s='{}x{}'.format(width, height), framerate=fps)
+        .output(output_path, pix_fmt='yuv420p', an=None, **profile.output_args(bitrate), **output_args)  # an=None removes the audio
+        .overwrite_output()
+        .global_args('-loglevel', 'quiet')  # Suppress ffmpeg console output
+        .run_async(pipe_stdin=True)
+    )
+
+def finish_encoder(process):
+    process.stdin.close()
+    return process.wait()
+
+def partial_path(output_path):
+    # Outputs are written under this name and renamed once complete, an interrupted clip never
+    # leaves a truncated file at output_path that a later run would take as done
+    directory, name = os.path.split(output_path)
+    return os.path.join(directory, f".part{os.getpid()}_{name}")
+
+def remove_output(output_path):
+    for path in (output_path, partial_path(output_path)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def remove_partials(output_path):
+    # Partial outputs of any process, e.g. of a worker that was killed while writing the clip
+    directory, name = os.path.split(output_path)
+    for path in glob.glob(os.path.join(glob.escape(directory), f".part*_{glob.escape(name)}")):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+class EncodeWriter:
+    # Re-encodes every frame of the clip through one rawvideo pipe
+    def __init__(self, media, output_path, profile=None, feed_yuv=False):
+        self.feed_yuv = feed_yuv
+        self.output_path = output_path
+        self.process = start_encoder(partial_path(output_path), media.width, media.height, media.fps, media.bitrate, profile, feed_yuv)
+        self.encoded_frames = 0
+        self.copied_frames = 0
+
+    def write(self, frame, touched=True):
+        self.process.stdin.write(frame_bytes(frame, self.feed_yuv))
+        self.encoded_frames += 1
+
+    def close(self):
+        if finish_encoder(self.process) != 0:
+            remove_output(self.output_path)
+            raise IOError(f"ffmpeg failed to encode {self.output_path}")
+        os.replace(partial_path(self.output_path), self.output_path)
+
+    def abort(self):
+        finish_encoder(self.process)
+        remove_output(self.output_path)
+
+class SegmentWriter:
+    # Frames are grouped by the GOPs of the source. GOPs without any inpainted frame are dropped and
+    # stream-copied from the source afterwards, consecutive touched GOPs are re-encoded as one segment.
+    # Segments are cut as MPEG-TS so the parameter sets of copied and encoded parts survive the concat
+    def __init__(self, media, output_path, keyframes, max_buffer=128, profile=None, feed_yuv=False):
+        self.media = media
+        self.profile = profile
+        self.feed_yuv = feed_yuv
+        self.output_path = output_path
+        self.keyframe_times = [keyframe_time for _, keyframe_time in keyframes]
+        self.boundaries = [index for index, _ in keyframes[1:]]
+        self.max_buffer = max_buffer
+        self.tmp_dir = tempfile.mkdtemp(prefix='.segments_', dir=os.path.dirname(os.path.abspath(output_path)))
+        self.segments = []  # [copy, first GOP, last GOP]
+        self.gop = 0
+        self.frame_index = 0
+        self.buffer = []
+        self.encoding = False
+        self.encoder = None
+        self.encoded_frames = 0
+        self.copied_frames = 0
+
+    def segment_path(self, segment_index, copy):
+        return os.path.join(self.tmp_dir, f"{'source' if copy else 'encoded'}_{segment_index:04d}.ts")
+
+    def finish_segment(self):
+        # A segment whose encode failed would be concatenated truncated, the clip fails instead
+        process, self.encoder = self.encoder, None
+        if finish_encoder(process) != 0:
+            raise IOError(f"ffmpeg failed to encode segment {len(self.segments) - 1} of {self.output_path}")
+
+    def add_gop(self, copy):
+        last = self.segments[-1] if self.segments else None
+        if last is not None and last[0] == copy:
+            last[2] = self.gop
+            return
+        if copy and self.encoder is not None:
+            self.finish_segment()
+        self.segments.append([copy, self.gop, self.gop])
+        if not copy:
+            self.encoder = start_encoder(self.segment_path(len(self.segments) - 1, False), self.media.width, self.media.height,
+                                         self.media.fps, self.media.bitrate, self.profile, self.feed_yuv, format='mpegts')
+
+    def encode(self, frame):
+        self.encoder.stdin.write(frame_bytes(frame, self.feed_yuv))
+        self.encoded_frames += 1
+
+    def end_gop(self):
+        if not self.encoding:
+            self.add_gop(copy=True)
+            self.copied_frames += len(self.buffer)
+        self.buffer = []
+        self.encoding = False
+        self.gop += 1
+
+    def write(self, frame, touched=True):
+        if self.gop < len(self.boundaries) and self.frame_index == self.boundaries[self.gop]:
+            self.end_gop()
+        self.frame_index += 1
+
+        if not self.encoding and (touched or len(self.buffer) >= self.max_buffer):
+            # The untouched frames buffered so far belong to a GOP that has to be re-encoded after all
+            self.encoding = True
+            self.add_gop(copy=False)
+            for buffered_frame in self.buffer:
+                self.encode(buffered_frame)
+            self.buffer = []
+        if self.encoding:
+            self.encode(frame)
+        else:
+            self.buffer.append(frame)
+
+    def close(self):
+        try:
+            self.end_gop()
+            if self.encoder is not None:
+                self.finish_segment()
+
+            if any(copy for copy, _, _ in self.segments):
+                # Cut the source at the first keyframe of every segment, the pieces of encoded segments are unused
+                cut_times = [self.keyframe_times[first] - 0.5 / self.media.fps for _, first, _ in self.segments[1:]]
+                segment_args = {'segment_times': ','.join(f"{cut_time:.6f}" for cut_time in cut_times)} if cut_times else {}
+                (
+                    ffmpeg
+                    .input(self.media.path)
+                    .output(os.path.join(self.tmp_dir, 'source_%04d.ts'), map='0:v:0', c='copy', f='segment',
+                            segment_format='mpegts', reset_timestamps=1, **segment_args)
+                    .overwrite_output()
+                    .global_args('-loglevel', 'quiet')
+                    .run()
+                )
+
+            list_path = os.path.join(self.tmp_dir, 'segments.txt')
+            with open(list_path, 'w') as file:
+                for i, (copy, _, _) in enumerate(self.segments):
+                    file.write(f"file '{self.segment_path(i, copy)}'\n")
+            (
+                ffmpeg
+                .input(list_path, format='concat', safe=0)
+                .output(partial_path(self.output_path), c='copy')
+                .overwrite_output()
+                .global_args('-loglevel', 'quiet')
+                .run()
+            )
+            os.replace(partial_path(self.output_path), self.output_path)
+            logging.info(f"Stream-copied {self.copied_frames} and re-encoded {self.encoded_frames} frames "
+                         f"in {len(self.segments)} segments for video: {self.media.path}")
+        except BaseException:
+            remove_output(self.output_path)
+            raise
+        finally:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def abort(self):
+        if self.encoder is not None:
+            finish_encoder(self.encoder)
+            self.encoder = None
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        remove_output(self.output_path)
@@ -0,0 +1,121 @@
+import os
+import time
+import sqlite3
+
+# Clip statuses as used in the processed log csv
+PENDING = 0
+PROCESSED = 1
+NOT_FOUND = 2
+ALREADY_EXISTS = 3
+NOT_READABLE = 4
+
+class StatusStore:
+    # SQLite backed replacement of the processed log csv, every status update is a single
+    # indexed row write instead of a rewrite of the whole csv file
+    def __init__(self, db_path, wal=True, timeout=60):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+        if wal:
+            # WAL needs shared memory between writers, keep the database on a local disk or a
+            # filesystem shared only by jobs on the same host
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+        else:
+            # Rollback journal with file locks, usable by jobs on different hosts sharing the filesystem
+            self.conn.execute('PRAGMA journal_mode=DELETE')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS clips (name TEXT PRIMARY KEY, status INTEGER NOT NULL DEFAULT 0)')
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(clips)')}
+        if 'owner' not in columns:
+            # Lease columns of the shared work queue, added in place to stores created before them
+            self.conn.execute('ALTER TABLE clips ADD COLUMN owner TEXT')
+            self.conn.execute('ALTER TABLE clips ADD COLUMN lease_expires REAL')
+        if 'attempts' not in columns:
+            # Number of worker processes that died on the clip
+            self.conn.execute('ALTER TABLE clips ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS clips_status ON clips (status)')
+
+    def import_csv(self, csv_path):
+        # Statuses already stored win over the csv so that an interrupted run can be resumed
+        rows = []
+        with open(csv_path, mode='r', encoding='utf-8') as infile:
+            for line in infile:
+                line = line.strip()
+                if not line:
+                    continue
+                name, _, status = line.rpartition(',')
+                if not name:
+                    name, status = status, PENDING
+                rows.append((name.strip(), int(status)))
+        # One explicit transaction, in autocommit mode every row would be its own commit and fsync
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.executemany('INSERT OR IGNORE INTO clips (name, status) VALUES (?, ?)', rows)
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return len(rows)
+
+    def update(self, name, status):
+        self.conn.execute('INSERT INTO clips (name, status) VALUES (?, ?) '
+                          'ON CONFLICT(name) DO UPDATE SET status = excluded.status, owner = NULL, lease_expires = NULL', (name, status))
+
+    def lease(self, owner, batch_size=8, lease_seconds=1800):
+        # Pending clips without a live lease are handed to one job at a time, the leases of a crashed
+        # job expire and its clips are picked up by the others
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            names = [row[0] for row in self.conn.execute(
+                'SELECT name FROM clips WHERE status = ? AND (lease_expires IS NULL OR lease_expires < ?) ORDER BY rowid LIMIT ?',
+                (PENDING, now, batch_size))]
+            self.conn.executemany('UPDATE clips SET owner = ?, lease_expires = ? WHERE name = ?',
+                                  [(owner, now + lease_seconds, name) for name in names])
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return names
+
+    def renew(self, owner, lease_seconds=1800):
+        # Heartbeat of a running job, extends the leases of all clips it still holds
+        self.conn.execute('UPDATE clips SET lease_expires = ? WHERE owner = ? AND status = ?', (time.time() + lease_seconds, owner, PENDING))
+
+    def release(self, owner):
+        # Unfinished clips of a job that stops go back to the queue right away instead of after expiry
+        self.conn.execute('UPDATE clips SET owner = NULL, lease_expires = NULL WHERE owner = ? AND status = ?', (owner, PENDING))
+
+    def fail(self, name, max_attempts=3):
+        # A worker died on the clip, it goes back to the queue until it has killed max_attempts workers
+        # and is then marked NOT_READABLE, so that one bad clip cannot take down every job in turn
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.execute('UPDATE clips SET attempts = attempts + 1, owner = NULL, lease_expires = NULL WHERE name = ?', (name,))
+            self.conn.execute('UPDATE clips SET status = ? WHERE name = ? AND status = ? AND attempts >= ?', (NOT_READABLE, name, PENDING, max_attempts))
+            status = self.get(name)
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return status
+
+    def get(self, name):
+        row = self.conn.execute('SELECT status FROM clips WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def pending(self):
+        return [row[0] for row in self.conn.execute('SELECT name FROM clips WHERE status = ? ORDER BY rowid', (PENDING,))]
+
+    def counts(self):
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM clips GROUP BY status'))
+
+    def export_csv(self, csv_path):
+        # Compact the store back into the csv format, written to a temporary file and swapped atomically
+        tmp_path = f"{csv_path}.tmp{os.getpid()}"
+        with open(tmp_path, mode='w', encoding='utf-8') as outfile:
+            for name, status in self.conn.execute('SELECT name, status FROM clips ORDER BY rowid'):
+                outfile.write(f"{name},{status}\n")
+        os.replace(tmp_path, csv_path)
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,129 @@
+import os
+import tempfile
+from math import ceil
+from multiprocessing import get_context
+import cv2
+import pytesseract
+
+try:
+    import tesserocr
+    from PIL import Image
+except ImportError:
+    tesserocr = None
+
+# Columns of tesseract's TSV output, the rows returned by TessBaseAPI.GetTSVText have no header
+TSV_COLUMNS = ('level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+               'left', 'top', 'width', 'height', 'conf', 'text')
+
+session = None
+
+def empty_data():
+    return {column: [] for column in TSV_COLUMNS}
+
+def parse_tsv(tsv):
+    # Same layout as pytesseract.image_to_data(..., output_type=Output.DICT)
+    data = empty_data()
+    for line in tsv.splitlines():
+        values = line.split('\t')
+        if len(values) < len(TSV_COLUMNS) - 1 or values[0] == 'level':
+            continue
+        values += [''] * (len(TSV_COLUMNS) - len(values))
+        for column, value in zip(TSV_COLUMNS, values):
+            if column == 'text':
+                data[column].append(value)
+            else:
+                data[column].append(float(value) if column == 'conf' else int(value))
+    return data
+
+class TesserocrSession:
+    # One TessBaseAPI kept alive for every crop instead of one tesseract process and temp PNG per call
+    def __init__(self, lang='eng'):
+        self.api = tesserocr.PyTessBaseAPI(lang=lang)
+
+    def image_to_data(self, images, psm=None):
+        self.api.SetPageSegMode(tesserocr.PSM.AUTO if psm is None else psm)
+        results = []
+        for image in images:
+            self.api.SetImage(Image.fromarray(image))
+            results.append(parse_tsv(self.api.GetTSVText(0)))
+        return results
+
+    def close(self):
+        self.api.End()
+
+class BatchedTesseract:
+    # Without tesserocr all crops of a call go through one tesseract process, tesseract reads a text
+    # file listing the images as a multi-page input and tags every row with its page number
+    def image_to_data(self, images, psm=None):
+        if not images:
+            return []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = []
+            for i, image in enumerate(images):
+                paths.append(os.path.join(tmp_dir, f"{i:05d}.png"))
+                cv2.imwrite(paths[-1], image)
+            list_path = os.path.join(tmp_dir, 'images.txt')
+            with open(list_path, 'w') as file:
+                file.write('\n'.join(paths) + '\n')
+            data = pytesseract.image_to_data(list_path, output_type=pytesseract.Output.DICT,
+                                             config=f'--psm {psm}' if psm is not None else '')
+
+        results = [empty_data() for _ in images]
+        for row, page in enumerate(data['page_num']):
+            for column in TSV_COLUMNS:
+                results[int(page) - 1][column].append(data[column][row])
+        return results
+
+    def close(self):
+        pass
+
+def open_session(backend='auto'):
+    if backend == 'tesserocr' and tesserocr is None:
+        raise ImportError("The tesserocr backend needs the tesserocr package")
+    if backend in ('auto', 'tesserocr') and tesserocr is not None:
+        return TesserocrSession()
+    return BatchedTesseract()
+
+def init_session(backend='auto', tesseract_cmd=None):
+    global session
+    # Tesseract's own OpenMP threads would oversubscribe the cores already split between the workers
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+    if tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    session = open_session(backend)
+
+def session_image_to_data(task):
+    images, psm = task
+    return session.image_to_data(images, psm)
+
+class TesseractPool:
+    # Sessions spread over processes, every call splits its crops into one contiguous chunk per worker
+    def __init__(self, processes=None, backend='auto', tesseract_cmd=None):
+        self.processes = processes or os.cpu_count()
+        self.pool = None
+        if self.processes > 1:
+            self.pool = get_context('spawn').Pool(self.processes, initializer=init_session, initargs=(backend, tesseract_cmd))
+        else:
+            if tesseract_cmd:
+                pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+            self.session = open_session(backend)
+
+    def image_to_data(self, images, psm=None):
+        if self.pool is None:
+            return self.session.image_to_data(images, psm)
+        chunk_size = max(1, ceil(len(images) / self.processes))
+        tasks = [(images[i:i + chunk_size], psm) for i in range(0, len(images), chunk_size)]
+        return [data for chunk in self.pool.map(session_image_to_data, tasks) for data in chunk]
+
+    def close(self):
+        if self.pool is None:
+            self.session.close()
+        else:
+            self.pool.close()
+            self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,107 @@
+import os
+import zipfile
+import numpy as np
+
+MASKS_VERSION = 1
+MASKS_SUFFIX = '.masks.npz'
+
+def masks_path(output_dir, filename):
+    return os.path.join(output_dir, os.path.splitext(filename)[0] + MASKS_SUFFIX)
+
+class MaskWriter:
+    # Writer with the interface of the video writers that stores the text masks of a clip instead of
+    # frames. Consecutive frames with the same mask form one run, and every distinct mask is stored
+    # once, bit-packed. Masks only change on OCR calls, so a clip holds a few runs instead of a mask per frame
+    def __init__(self, output_path, width, height, text_detected=True):
+        self.output_path = output_path
+        self.shape = (height, width)
+        self.text_detected = text_detected
+        self.run_starts = []
+        self.run_masks = []
+        self.masks = []
+        self.mask_ids = {}
+        self.last_mask = None
+        self.frame_count = 0
+
+    def write(self, mask, touched=True):
+        if self.last_mask is None or not np.array_equal(mask, self.last_mask):
+            if touched:
+                packed = np.packbits(mask.reshape(-1) > 0)
+                key = packed.tobytes()
+                if key not in self.mask_ids:
+                    self.mask_ids[key] = len(self.masks)
+                    self.masks.append(packed)
+                mask_id = self.mask_ids[key]
+            else:
+                mask_id = -1
+            if not self.run_masks or self.run_masks[-1] != mask_id:
+                self.run_starts.append(self.frame_count)
+                self.run_masks.append(mask_id)
+            self.last_mask = mask
+        self.frame_count += 1
+
+    def write_empty(self, frame_count):
+        # Frames known to have no text, e.g. a whole clip rejected by the text sampling
+        if not self.run_masks or self.run_masks[-1] != -1:
+            self.run_starts.append(self.frame_count)
+            self.run_masks.append(-1)
+        self.last_mask = None
+        self.frame_count += frame_count
+
+    def close(self):
+        size = self.shape[0] * self.shape[1]
+        arrays = {
+            'version': np.int32(MASKS_VERSION),
+            'shape': np.array(self.shape, dtype=np.int32),
+            'frame_count': np.int32(self.frame_count),
+            'text_detected': np.bool_(self.text_detected),
+            'run_starts': np.array(self.run_starts, dtype=np.int32),
+            'run_masks': np.array(self.run_masks, dtype=np.int32),
+            'masks': np.stack(self.masks) if self.masks else np.zeros((0, (size + 7) // 8), dtype=np.uint8),
+        }
+        tmp_path = f"{self.output_path}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as file:
+            np.savez_compressed(file, **arrays)
+        os.replace(tmp_path, self.output_path)
+
+    def abort(self):
+        pass
+
+class TextMasks:
+    # Reader of a MaskWriter file, masks are unpacked on access
+    def __init__(self, path):
+        with np.load(path) as arrays:
+            if int(arrays['version']) != MASKS_VERSION:
+                raise ValueError(f"Unsupported text mask version {int(arrays['version'])} in {path}")
+            self.shape = tuple(int(size) for size in arrays['shape'])
+            self.frame_count = int(arrays['frame_count'])
+            self.text_detected = bool(arrays['text_detected'])
+            self.run_starts = arrays['run_starts']
+            self.run_masks = arrays['run_masks']
+            self.packed = arrays['masks']
+
+    def __len__(self):
+        return self.frame_count
+
+    def runs(self):
+        # (first frame, end frame, mask id), the mask id is -1 for runs without text
+        ends = np.append(self.run_starts[1:], self.frame_count)
+        return [(int(start), int(end), int(mask_id)) for start, end, mask_id in zip(self.run_starts, ends, self.run_masks)]
+
+    def unpack(self, mask_id):
+        if mask_id < 0:
+            return np.zeros(self.shape, dtype=np.uint8)
+        size = self.shape[0] * self.shape[1]
+        return np.unpackbits(self.packed[mask_id], count=size).reshape(self.shape) * np.uint8(255)
+
+    def mask(self, frame_index):
+        if not 0 <= frame_index < self.frame_count:
+            raise IndexError(f"Frame {frame_index} out of range of {self.frame_count} frames")
+        run = np.searchsorted(self.run_starts, frame_index, side='right') - 1
+        return self.unpack(int(self.run_masks[run]) if run >= 0 else -1)
+
+def load_text_masks(path):
+    try:
+        return TextMasks(path)
+    except (FileNotFoundError, zipfile.BadZipFile, KeyError):
+        return None
@@ -1,57 +1,35 @@
 import os
+import sys
 import re
-import glob
 import itertools
-import cv2
 import argparse
 import csv
 import time
-import subprocess
-import json
 import pandas as pd
 
-def get_file_names(PATH_input):
-    video_files = [f for f in os.listdir(PATH_input) if (f.endswith('.mp4') or f.endswith('.webm'))]
-    return video_files
-
-def find_matching_files(directory_path, base_filename, fformat, middle_pattern):
-    pattern = f"{base_filename}{middle_pattern}{fformat}"
-    matching_files = glob.glob(os.path.join(directory_path, pattern))
-    return [os.path.basename(f) for f in matching_files]
-
-def get_video_properties(ffmpeg_path,video_path):
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        raise IOError(f"Cannot open video file {video_path}")
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    cap.release()
-
-    result = subprocess.run(
-        ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-count_frames', '-show_entries', 'stream=nb_read_frames', '-of', 'json', "-threads", "16",'-preset', 'ultrafast', video_path],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        universal_newlines=True
-    )
-    info = json.loads(result.stdout)
-    total_frames = int(info['streams'][0]['nb_read_frames'])
-
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.encoder import add_encoder_arguments, encoder_profile_from_args
+from common.prefetch import OutputMover, Prefetcher, prefetched
+from common.segments import cut_clips
+from common.probe import ProbeCache, probe_video
+from common.media_index import MediaIndex
+from common.directory_index import DirectoryIndex
+
+def get_video_properties(ffmpeg_path, video_path, probe_cache=None, local_path=None):
+    # Container metadata read once by ffprobe, without decoding the video to count its frames. The
+    # cache or media index is keyed by video_path, ffprobe runs on its local copy when there is one
+    if probe_cache is not None:
+        properties = probe_cache.probe(video_path, local_path)
+    else:
+        properties = probe_video(local_path or video_path)
+    fps, width, height, total_frames = properties['fps'], properties['width'], properties['height'], properties['total_frames']
     total_time = total_frames/fps
     return fps, width, height, total_time
 
-def process_clip(ffmpeg_path, video_path, start_time, duration, segment_file):
-    command = [
-        "ffmpeg", "-ss", str(start_time), "-i", video_path, "-t", str(duration),
-        "-c", "copy", segment_file
-    ]   
-    subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    print(f"Finished processing segment: {segment_file}")
-
-    return segment_file
-
-def trim_video(video_path, video_id, columns, clip_names, output_dir, fps, width, height, total_time, ffmpeg_path="ffmpeg"):
+def trim_video(video_path, video_id, columns, clip_names, output_dir, fps, width, height, total_time, ffmpeg_path="ffmpeg", encoder_profile=None, staging_dir=None, mover=None, single_pass=False, max_shift=None):
     config_data = []
+    segments = []
+    segment_infos = {}
     for item in columns:
         try:
             columns.remove(',')
@@ -82,7 +60,10 @@ def trim_video(video_path, video_id, columns, clip_names, output_dir, fps, width
         if os.path.exists(segment_file):
             continue
         
-        process_clip(ffmpeg_path, video_path, start_time, duration, segment_file)
+        if single_pass:
+            segments.append((start_time, duration, segment_file))
+        else:
+            cut_clips(video_path, [(start_time, duration, segment_file)], encoder_profile, staging_dir, mover)
 
         segment_info = {
             "clip_id": name,
@@ -95,6 +76,17 @@ def trim_video(video_path, video_id, columns, clip_names, output_dir, fps, width
             "duration": round((end_time - start_time) / fps, 2)
         }
         config_data.append(segment_info)
+        segment_infos[segment_file] = segment_info
+
+    if segments:
+        # Single pass cuts snap to the nearest frames, the metadata gets the bounds actually cut
+        bounds = cut_clips(video_path, segments, encoder_profile, staging_dir, mover, single_pass, 1 / fps if max_shift is None else max_shift)
+        for segment_file, start_time, end_time in bounds:
+            segment_info = segment_infos[segment_file]
+            segment_info["start_frame"] = start_time
+            segment_info["end_frame"] = end_time
+            segment_info["nframes"] = end_time - start_time
+            segment_info["duration"] = round((end_time - start_time) / fps, 2)
     return config_data
 
 def read_csv_with_variable_columns(file_path):
@@ -126,10 +118,13 @@ def main(args):
     start_time = time.time()
     os.makedirs(output_dir, exist_ok=True)
     
-    file_names = get_file_names(data_dir)
-    file_names = [item for item in file_names if "webm.part" not in item]
+    # The data folder is listed once, every csv row is then a dict lookup instead of a glob over it
+    directory = DirectoryIndex(data_dir)
     ffmpeg_path = "/auto/plzen1/home/valacho/ffmpeg/"  # Full path to the ffmpeg executable
     all_config_data = []
+    encoder_profile = encoder_profile_from_args(args)
+    if args.single_pass and encoder_profile is None:
+        print("--single_pass needs an encoder profile, stream-copied clips are cut one by one")
 
     try:
         csv_data = read_csv_with_variable_columns(csv_dir)
@@ -143,14 +138,13 @@ def main(args):
 
     paired_lines = itertools.zip_longest(*[iter(lines)]*2)
 
+    jobs = []
     for line1, line2 in paired_lines:
         columns = line1.split('"')[1:]
         filename = line1.split(',')[0]
         clip_names = line2.split(',')[1:]
 
-        files_mp4s = find_matching_files(data_dir, filename, "mp4", middle_pattern='.')
-        files_webms = find_matching_files(data_dir, filename, "webm", middle_pattern='.')
-        files_videos = files_mp4s + files_webms
+        files_videos = directory.videos(filename)
         
         if len(files_videos) == 1:
             video_file = files_videos[0]
@@ -158,18 +152,42 @@ def main(args):
             print(f"No matching video file found for {filename}")
             continue
                     
-        video_path = os.path.join(data_dir, video_file)
-        
-        try:
-            fps, width, height, total_time = get_video_properties(ffmpeg_path, video_path)
-        except IOError as e:
-            print(e)
-            continue
-        
-        config_data = trim_video(video_path, filename, columns, clip_names, output_dir, fps, width, height, total_time, ffmpeg_path)
-        
-        if config_data:
-            all_config_data.extend(config_data)
+        jobs.append((filename, columns, clip_names, os.path.join(data_dir, video_file)))
+
+    if args.media_index:
+        probe_cache = MediaIndex(args.media_index)
+    else:
+        probe_cache = ProbeCache(args.probe_cache or os.path.join(output_dir, '.probe_cache.json'))
+
+    # With a scratch folder the next videos are copied to local disk while the current one is cut
+    prefetcher = Prefetcher(os.path.join(args.scratch_dir, 'inputs'), int(args.scratch_gb * 1024 ** 3)) if args.scratch_dir else None
+    mover = OutputMover() if args.scratch_dir else None
+    staging_dir = os.path.join(args.scratch_dir, 'clips') if args.scratch_dir else None
+    if staging_dir:
+        os.makedirs(staging_dir, exist_ok=True)
+
+    try:
+        for (filename, columns, clip_names, video_path), local_path in prefetched(jobs, prefetcher, lambda job: job[3], args.prefetch):
+            try:
+                fps, width, height, total_time = get_video_properties(ffmpeg_path, video_path, probe_cache, local_path)
+                config_data = trim_video(local_path, filename, columns, clip_names, output_dir, fps, width, height, total_time, ffmpeg_path, encoder_profile, staging_dir, mover, args.single_pass, args.max_shift)
+            except IOError as e:
+                print(e)
+                continue
+            finally:
+                if prefetcher is not None:
+                    prefetcher.release(video_path)
+            
+            if config_data:
+                all_config_data.extend(config_data)
+    finally:
+        probe_cache.save()
+        if prefetcher is not None:
+            prefetcher.close()
+        if mover is not None:
+            for segment_file, error in mover.close():
+                if error is not None:
+                    print(f"Moving {segment_file} failed: {error}")
     
     if all_config_data:
         csv_file = os.path.join(output_dir, "!metadata.csv")
@@ -186,6 +204,14 @@ if __name__ == "__main__":
     parser.add_argument('--inputdir', type=str, required=True, help="Path to the input files")
     parser.add_argument('--csv_dir', type=str, required=True, help="Output logfile")
     parser.add_argument('--output', type=str, required=True, help="Path to the output video folder")
+    add_encoder_arguments(parser, default=None, help="Re-encode the clips with these encoder settings instead of stream copying them")
+    parser.add_argument('--media_index', type=str, default=None, help="SQLite media index of the corpus (see common/media_index.py), used instead of --probe_cache")
+    parser.add_argument('--probe_cache', type=str, default=None, help="JSON index of the probed video properties, reused by later runs (default: .probe_cache.json in the output folder)")
+    parser.add_argument('--single_pass', action='store_true', help="With an encoder profile, cut all clips of a video in one ffmpeg run with the segment muxer, overlapping clips are still cut one by one")
+    parser.add_argument('--max_shift', type=float, default=None, help="Seconds a single pass cut may land off the requested bounds before the clip is cut on its own (default: one frame)")
+    parser.add_argument('--scratch_dir', type=str, default=None, help="Local scratch folder, the next videos are prefetched into it and the clips are cut there and moved to --output in the background")
+    parser.add_argument('--scratch_gb', type=float, default=20, help="Size budget of the prefetched videos in the scratch folder")
+    parser.add_argument('--prefetch', type=int, default=2, help="Number of upcoming videos prefetched while the current one is cut")
     args = parser.parse_args()
     
-    main()
\ No newline at end of file
+    main(args)
\ No newline at end of file
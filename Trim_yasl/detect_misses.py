@@ -1,6 +1,6 @@
 import os
+import sys
 import re
-import glob
 import hashlib
 import base64
 import cv2
@@ -11,14 +11,8 @@ import subprocess
 import json
 import pandas as pd
 
-def get_file_names(PATH_input):
-    video_files = [f for f in os.listdir(PATH_input) if (f.endswith('.mp4') or f.endswith('.webm'))]
-    return video_files
-
-def find_matching_files(directory_path, base_filename, fformat, middle_pattern):
-    pattern = f"{base_filename}{middle_pattern}{fformat}"
-    matching_files = glob.glob(os.path.join(directory_path, pattern))
-    return [os.path.basename(f) for f in matching_files]
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.directory_index import DirectoryIndex
 
 def get_video_properties(video_path):
     cap = cv2.VideoCapture(video_path)
@@ -130,8 +124,7 @@ if __name__ == "__main__":
     output_dir = "/auto/plzen1/home/mhruz/JSALT2024/YouTubeASL/clips/"
     os.makedirs(output_dir, exist_ok=True)
     
-    file_names = get_file_names(data_dir)
-    file_names = [item for item in file_names if "webm.part" not in item]
+    directory = DirectoryIndex(data_dir)
     ffmpeg_path = "/auto/plzen1/home/valacho/ffmpeg/"  # Ffmpeg executable
     all_config_data = []
 
@@ -145,10 +138,8 @@ if __name__ == "__main__":
         for line in csv_file:
             filename = line[:11]
 
-            files_vtts = find_matching_files(data_dir, filename, "vtt", middle_pattern='.*.')
-            files_mp4s = find_matching_files(data_dir, filename, "mp4", middle_pattern='.')
-            files_webms = find_matching_files(data_dir, filename, "webm", middle_pattern='.')
-            files_videos = files_mp4s + files_webms
+            files_vtts = directory.vtts(filename)
+            files_videos = directory.videos(filename)
             a = 0
             b = 0
             if len(files_vtts) == 1:
@@ -1,61 +1,63 @@
 import os
+import sys
 import re
-import glob
 import hashlib
 import base64
-import cv2
 import webvtt
 import argparse
 import csv
 import time
-import subprocess
-import json
 import pandas as pd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-def get_file_names(PATH_input):
-    video_files = [f for f in os.listdir(PATH_input) if (f.endswith('.mp4') or f.endswith('.webm'))]
-    return video_files
-
-def find_matching_files(directory_path, base_filename, fformat, middle_pattern):
-    pattern = f"{base_filename}{middle_pattern}{fformat}"
-    matching_files = glob.glob(os.path.join(directory_path, pattern))
-    return [os.path.basename(f) for f in matching_files]
-
-def get_video_properties(ffmpeg_path,video_path):
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        raise IOError(f"Cannot open video file {video_path}")
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    cap.release()
-
-    start = time.time()
-    result = subprocess.run(
-        ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-count_frames', '-show_entries', 'stream=nb_read_frames', '-of', 'json', "-threads", "16",'-preset', 'ultrafast', video_path],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        universal_newlines=True
-    )
-    end = time.time()
-    print(end-start)
-    info = json.loads(result.stdout)
-    total_frames = int(info['streams'][0]['nb_read_frames'])
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.encoder import add_encoder_arguments, encoder_profile_from_args
+from common.prefetch import OutputMover, Prefetcher, prefetched
+from common.segments import cut_clips, split_clips
+from common.probe import ProbeCache, probe_video
+from common.media_index import MediaIndex
+from common.directory_index import DirectoryIndex
 
+def get_video_properties(ffmpeg_path, video_path, probe_cache=None, local_path=None):
+    # Container metadata read once by ffprobe, without decoding the video to count its frames. The
+    # cache or media index is keyed by video_path, ffprobe runs on its local copy when there is one
+    if probe_cache is not None:
+        properties = probe_cache.probe(video_path, local_path)
+    else:
+        properties = probe_video(local_path or video_path)
+    fps, width, height, total_frames = properties['fps'], properties['width'], properties['height'], properties['total_frames']
     return fps, width, height, total_frames
 
-def process_clip(ffmpeg_path, video_path, start_time, duration, segment_file):
-    command = [
-        'ffmpeg', "-ss", str(start_time), "-i", video_path, "-t", str(duration),
-        "-c", "copy", segment_file
-    ]
-    subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    print(f"Finished processing segment: {segment_file}")
+def trim_video(vtt, video_path, video_id, columns, output_dir, fps, width, height, total_frames, executor, ffmpeg_path="ffmpeg", encoder_profile=None, staging_dir=None, mover=None, single_pass=False, max_shift=None):
+    # The cuts are only submitted to the executor, the metadata is returned in caption order together
+    # with the futures of the cuts. Each cut corrects the metadata to the bounds it was cut at
+    config_data = []
+    segments = []
+    segment_infos = {}
+    max_shift = 1 / fps if max_shift is None else max_shift
 
-    return segment_file
+    cuts = []
+
+    def record_bounds(bounds):
+        for segment_file, start_time, end_time in bounds:
+            segment_info = segment_infos[segment_file]
+            segment_info["start_frame"] = int(round(start_time * fps))
+            segment_info["end_frame"] = int(round(end_time * fps))
+            segment_info["nframes"] = segment_info["end_frame"] - segment_info["start_frame"]
+            segment_info["duration"] = round(segment_info["nframes"] / fps, 2)
+        return bounds
+
+    def cut_and_record(segments):
+        return record_bounds(cut_clips(video_path, segments, encoder_profile, staging_dir, mover))
+
+    def split_and_queue(segments):
+        # The clips the single pass did not write are queued as separate cuts on the shared executor.
+        # They are added to cuts before this future completes, so finish_video waits for them as well
+        bounds, remaining = split_clips(video_path, segments, encoder_profile, staging_dir, mover, max_shift)
+        cuts.extend(executor.submit(cut_and_record, [segment]) for segment in remaining)
+        return record_bounds(bounds)
 
-def trim_video(vtt, video_path, video_id, columns, output_dir, fps, width, height, total_frames, ffmpeg_path="ffmpeg"):
-    config_data = []
     for item in columns:
         try:
             columns.remove(',')
@@ -86,10 +88,11 @@ def trim_video(vtt, video_path, video_id, columns, output_dir, fps, width, heigh
         duration = (end_frame - start_frame) / fps
 
         segment_file = os.path.join(output_dir, f"{video_id}.{format(start_frame, '06d')}-{format(end_frame, '06d')}.mp4")
-        if os.path.exists(segment_file):
+        # Captions with the same frame range are cut once, the earlier cuts are only queued and not on disk yet
+        if os.path.exists(segment_file) or segment_file in segment_infos:
             continue
         
-        process_clip(ffmpeg_path, video_path, start_time, duration, segment_file)
+        segments.append((start_time, duration, segment_file))
 
         ann = re.sub(r'\s+', ' ', caption.text).strip()
 
@@ -105,7 +108,13 @@ def trim_video(vtt, video_path, video_id, columns, output_dir, fps, width, heigh
             "duration": round((end_frame - start_frame) / fps, 2)
         }
         config_data.append(segment_info)
-    return config_data
+        segment_infos[segment_file] = segment_info
+
+    if single_pass and encoder_profile is not None and len(segments) > 1:
+        cuts.append(executor.submit(split_and_queue, segments))
+    else:
+        cuts.extend(executor.submit(cut_and_record, [segment]) for segment in segments)
+    return config_data, cuts
 
 def read_csv_with_variable_columns(file_path):
     with open(file_path, 'r', encoding='utf-8') as file:
@@ -133,10 +142,13 @@ def main(args):
     start_time = time.time()
     os.makedirs(output_dir, exist_ok=True)
     
-    file_names = get_file_names(data_dir)
-    file_names = [item for item in file_names if "webm.part" not in item]
+    # The data folder is listed once, every csv row is then a dict lookup instead of a glob over it
+    directory = DirectoryIndex(data_dir)
     ffmpeg_path = args.ffmpeg # Full path to the ffmpeg executable
     all_config_data = []
+    encoder_profile = encoder_profile_from_args(args)
+    if args.single_pass and encoder_profile is None:
+        print("--single_pass needs an encoder profile, stream-copied clips are cut one by one")
 
     try:
         csv_data = read_csv_with_variable_columns(csv_dir)
@@ -144,15 +156,14 @@ def main(args):
         print(f"Error reading CSV file: {e}")
         exit(1)
 
+    jobs = []
     with open(csv_dir, 'r', encoding='utf-8') as csv_file:
         for line in csv_file:
             columns = line[13:].strip().split('"')
             filename = line[:11]
 
-            files_vtts = find_matching_files(data_dir, filename, "vtt", middle_pattern='.*.')
-            files_mp4s = find_matching_files(data_dir, filename, "mp4", middle_pattern='.')
-            files_webms = find_matching_files(data_dir, filename, "webm", middle_pattern='.')
-            files_videos = files_mp4s + files_webms
+            files_vtts = directory.vtts(filename)
+            files_videos = directory.videos(filename)
             if len(files_vtts) == 1:
                 vtt_file = files_vtts[0]
             else:
@@ -165,20 +176,68 @@ def main(args):
                 print(f"No matching video file found for {filename}")
                 continue
             
-            captions = webvtt.read(os.path.join(data_dir, vtt_file))
-            
-            video_path = os.path.join(data_dir, video_file)
-            
+            jobs.append((filename, columns, os.path.join(data_dir, vtt_file), os.path.join(data_dir, video_file)))
+
+    if args.media_index:
+        probe_cache = MediaIndex(args.media_index)
+    else:
+        probe_cache = ProbeCache(args.probe_cache or os.path.join(output_dir, '.probe_cache.json'))
+
+    # With a scratch folder the next videos are copied to local disk while the current one is cut
+    prefetcher = Prefetcher(os.path.join(args.scratch_dir, 'inputs'), int(args.scratch_gb * 1024 ** 3)) if args.scratch_dir else None
+    mover = OutputMover() if args.scratch_dir else None
+    staging_dir = os.path.join(args.scratch_dir, 'clips') if args.scratch_dir else None
+    if staging_dir:
+        os.makedirs(staging_dir, exist_ok=True)
+
+    # Cuts of the current and the previous video run concurrently in one bounded pool, a prefetched
+    # video is released once all of its cuts have finished
+    executor = ThreadPoolExecutor(args.jobs)
+    pending = deque()
+    clip_count = 0
+    cut_start = time.time()
+
+    def finish_video(video_path, cuts):
+        nonlocal clip_count
+        for cut in cuts:
+            try:
+                clip_count += len(cut.result())
+            except Exception as e:
+                print(f"Cut of {video_path} failed: {e}")
+        if prefetcher is not None:
+            prefetcher.release(video_path)
+
+    try:
+        for (filename, columns, vtt_path, video_path), local_path in prefetched(jobs, prefetcher, lambda job: job[3], args.prefetch):
             try:
-                fps, width, height, total_frames = get_video_properties(ffmpeg_path, video_path)
+                captions = webvtt.read(vtt_path)
+                fps, width, height, total_frames = get_video_properties(ffmpeg_path, video_path, probe_cache, local_path)
+                config_data, cuts = trim_video(captions, local_path, filename, columns, output_dir, fps, width, height, total_frames,
+                                               executor, ffmpeg_path, encoder_profile, staging_dir, mover, args.single_pass, args.max_shift)
             except IOError as e:
                 print(e)
+                finish_video(video_path, [])
                 continue
             
-            config_data = trim_video(captions, video_path, filename, columns, output_dir, fps, width, height, total_frames, ffmpeg_path)
+            pending.append((video_path, cuts))
+            while len(pending) > 1:
+                finish_video(*pending.popleft())
             
             if config_data:
                 all_config_data.extend(config_data)
+        while pending:
+            finish_video(*pending.popleft())
+    finally:
+        probe_cache.save()
+        executor.shutdown(wait=True)
+        if prefetcher is not None:
+            prefetcher.close()
+        if mover is not None:
+            for segment_file, error in mover.close():
+                if error is not None:
+                    print(f"Moving {segment_file} failed: {error}")
+    cut_time = time.time() - cut_start
+    print(f"Cut {clip_count} clips in {cut_time:.1f}s, {clip_count / cut_time if cut_time else 0:.2f} clips/s with {args.jobs} concurrent ffmpeg processes")
     
     if all_config_data:
         csv_file = os.path.join(output_dir, "!metadata.csv")
@@ -196,6 +255,15 @@ if __name__ == "__main__":
     parser.add_argument('--csv_dir', type=str, required=True, help="Output logfile")
     parser.add_argument('--output', type=str, required=True, help="Path to the output video folder")
     parser.add_argument('--ffmpeg', type=str, required=True, help="Path to the ffmpeg executable")
+    add_encoder_arguments(parser, default=None, help="Re-encode the clips with these encoder settings instead of stream copying them")
+    parser.add_argument('--jobs', type=int, default=len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count(), help="Number of ffmpeg cuts run concurrently, shared by the current and the next video")
+    parser.add_argument('--media_index', type=str, default=None, help="SQLite media index of the corpus (see common/media_index.py), used instead of --probe_cache")
+    parser.add_argument('--probe_cache', type=str, default=None, help="JSON index of the probed video properties, reused by later runs (default: .probe_cache.json in the output folder)")
+    parser.add_argument('--single_pass', action='store_true', help="With an encoder profile, cut all clips of a video in one ffmpeg run with the segment muxer, overlapping clips are still cut one by one")
+    parser.add_argument('--max_shift', type=float, default=None, help="Seconds a single pass cut may land off the requested bounds before the clip is cut on its own (default: one frame)")
+    parser.add_argument('--scratch_dir', type=str, default=None, help="Local scratch folder, the next videos are prefetched into it and the clips are cut there and moved to --output in the background")
+    parser.add_argument('--scratch_gb', type=float, default=20, help="Size budget of the prefetched videos in the scratch folder")
+    parser.add_argument('--prefetch', type=int, default=2, help="Number of upcoming videos prefetched while the current one is cut")
     args = parser.parse_args()
     
     main(args)
@@ -0,0 +1,36 @@
+import os
+from collections import defaultdict
+
+VIDEO_EXTENSIONS = ('.mp4', '.webm')
+
+class DirectoryIndex:
+    # One listing of a data folder grouped by video id, replaces a glob over the whole folder per lookup.
+    # Videos match <id>.mp4 or <id>.webm and subtitles <id>.*.vtt, the same names the globs matched
+    def __init__(self, directory, video_extensions=VIDEO_EXTENSIONS):
+        self.directory = directory
+        self.files = defaultdict(lambda: {'videos': [], 'vtts': []})
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                name = entry.name
+                if name.startswith('.'):
+                    continue
+                stem, extension = os.path.splitext(name)
+                if extension in video_extensions:
+                    self.files[stem]['videos'].append(name)
+                elif extension == '.vtt':
+                    # Every id the name can start with, "a.b.en.vtt" is a subtitle of both "a" and "a.b"
+                    dot = name.find('.')
+                    while 0 < dot < len(stem):
+                        self.files[name[:dot]]['vtts'].append(name)
+                        dot = name.find('.', dot + 1)
+
+    def videos(self, video_id):
+        entry = self.files.get(video_id)
+        return sorted(entry['videos'], key=lambda name: name.endswith('.webm')) if entry else []
+
+    def vtts(self, video_id):
+        entry = self.files.get(video_id)
+        return list(entry['vtts']) if entry else []
+
+    def video_names(self):
+        return [name for entry in self.files.values() for name in entry['videos']]
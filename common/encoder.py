@@ -0,0 +1,84 @@
+import cv2
+
+# Encoders producing H.264, only their output can be concatenated with stream-copied H.264 segments
+H264_ENCODERS = ('libx264', 'h264_nvenc')
+
+class EncoderProfile:
+    # Encoder settings shared by the OCR output pipe and the trim scripts. Without crf the
+    # source bitrate is kept, unset fields are left to the ffmpeg defaults
+    def __init__(self, name, codec='libx264', preset=None, crf=None, threads=None, tune=None):
+        self.name = name
+        self.codec = codec
+        self.preset = preset
+        self.crf = crf
+        self.threads = threads
+        self.tune = tune
+
+    def output_args(self, bitrate=None):
+        # Keyword arguments of ffmpeg-python's output()
+        args = {'vcodec': self.codec}
+        if self.preset is not None:
+            args['preset'] = self.preset
+        if self.tune is not None:
+            args['tune'] = self.tune
+        if self.crf is not None:
+            # h264_nvenc has no crf, its constant quality mode is cq
+            args['cq' if self.codec == 'h264_nvenc' else 'crf'] = self.crf
+        elif bitrate:
+            args['video_bitrate'] = bitrate
+        if self.threads is not None:
+            args['threads'] = self.threads
+        return args
+
+    def command_args(self, bitrate=None):
+        # The same settings as a subprocess argument list
+        names = {'vcodec': '-c:v', 'video_bitrate': '-b:v'}
+        args = []
+        for key, value in self.output_args(bitrate).items():
+            args.extend([names.get(key, f"-{key}"), str(value)])
+        return args
+
+    def __repr__(self):
+        return (f"EncoderProfile({self.name!r}, codec={self.codec!r}, preset={self.preset!r}, crf={self.crf!r}, "
+                f"threads={self.threads!r}, tune={self.tune!r})")
+
+ENCODER_PROFILES = {
+    'default': EncoderProfile('default'),
+    'ultrafast': EncoderProfile('ultrafast', preset='ultrafast', crf=23, threads=16),
+    'fast': EncoderProfile('fast', preset='veryfast', crf=20),
+    'quality': EncoderProfile('quality', preset='slow', crf=18),
+    'nvenc': EncoderProfile('nvenc', codec='h264_nvenc', preset='p4', crf=23),
+}
+
+def get_encoder_profile(name='default', preset=None, crf=None, threads=None, tune=None):
+    # Named profile with the explicitly given fields overridden
+    if name not in ENCODER_PROFILES:
+        raise ValueError(f"Unknown encoder profile '{name}', expected one of {tuple(ENCODER_PROFILES)}")
+    base = ENCODER_PROFILES[name]
+    return EncoderProfile(name, base.codec,
+                          base.preset if preset is None else preset,
+                          base.crf if crf is None else crf,
+                          base.threads if threads is None else threads,
+                          base.tune if tune is None else tune)
+
+def add_encoder_arguments(parser, default='default', help="Named encoder settings, the options below override single fields"):
+    parser.add_argument('--encoder_profile', type=str, default=default, choices=tuple(ENCODER_PROFILES), help=help)
+    parser.add_argument('--preset', type=str, default=None, help="Encoder preset, e.g. ultrafast or veryfast for libx264")
+    parser.add_argument('--crf', type=int, default=None, help="Constant quality value, the source bitrate is used when unset")
+    parser.add_argument('--encode_threads', type=int, default=None, help="Number of encoder threads (default: chosen by ffmpeg)")
+    parser.add_argument('--tune', type=str, default=None, help="Encoder tune, e.g. film or fastdecode for libx264")
+
+def encoder_profile_from_args(args):
+    if args.encoder_profile is None:
+        return None
+    return get_encoder_profile(args.encoder_profile, args.preset, args.crf, args.encode_threads, args.tune)
+
+def can_feed_yuv(width, height):
+    # 4:2:0 subsampling needs even frame dimensions
+    return width % 2 == 0 and height % 2 == 0
+
+def frame_bytes(frame, feed_yuv=False):
+    # BGR frame as raw bgr24, or converted to planar yuv420p so ffmpeg skips its own conversion
+    if feed_yuv:
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420).tobytes()
+    return frame.tobytes()
@@ -0,0 +1,129 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.probe import keyframe_times, probe_video
+from common.directory_index import DirectoryIndex
+
+COLUMNS = ('fps', 'width', 'height', 'total_frames', 'source', 'duration', 'bitrate', 'codec', 'pix_fmt', 'start_time', 'keyframes', 'vtt_path')
+
+class MediaIndex:
+    # SQLite index of the probed metadata of every video and clip of the corpus. Entries are keyed by
+    # path and only valid while the file keeps its size and mtime, stale entries are probed again
+    def __init__(self, db_path, timeout=60):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        # Rollback journal with file locks, the index is shared by jobs on different hosts
+        self.conn.execute('PRAGMA journal_mode=DELETE')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS media (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL, '
+                          'fps REAL, width INTEGER, height INTEGER, total_frames INTEGER, source TEXT, duration REAL, bitrate INTEGER, '
+                          'codec TEXT, pix_fmt TEXT, start_time REAL, keyframes TEXT, vtt_path TEXT, probed REAL)')
+
+    def lookup(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        row = self.conn.execute(f"SELECT {', '.join(COLUMNS)} FROM media WHERE path = ? AND size = ? AND mtime = ?",
+                                (os.path.abspath(path), stat.st_size, stat.st_mtime)).fetchone()
+        if row is None:
+            return None
+        entry = dict(zip(COLUMNS, row))
+        entry['keyframes'] = json.loads(entry['keyframes']) if entry['keyframes'] is not None else None
+        return entry
+
+    def store(self, path, entry):
+        stat = os.stat(path)
+        values = dict(entry, keyframes=json.dumps(entry['keyframes']) if entry.get('keyframes') is not None else None)
+        self.conn.execute(f"INSERT OR REPLACE INTO media (path, size, mtime, {', '.join(COLUMNS)}, probed) "
+                          f"VALUES (?, ?, ?, {', '.join('?' * len(COLUMNS))}, ?)",
+                          (os.path.abspath(path), stat.st_size, stat.st_mtime, *[values.get(column) for column in COLUMNS], time.time()))
+
+    def probe(self, video_path, local_path=None):
+        # Same interface as ProbeCache, a miss is probed on local_path (e.g. a prefetched copy) and
+        # stored under video_path
+        entry = self.lookup(video_path)
+        if entry is None:
+            entry = dict(probe_video(local_path or video_path), keyframes=None, vtt_path=None)
+            self.store(video_path, entry)
+        return entry
+
+    def paths(self, prefix=''):
+        return [row[0] for row in self.conn.execute('SELECT path FROM media WHERE path LIKE ?', (f"{prefix}%",))]
+
+    def remove(self, paths):
+        # Autocommit connection, an explicit transaction avoids one commit per deleted row
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.executemany('DELETE FROM media WHERE path = ?', [(path,) for path in paths])
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def save(self):
+        # Every store is committed right away, kept for the ProbeCache interface
+        pass
+
+    def close(self):
+        self.conn.close()
+
+def index_entry(video_path, keyframes=False, vtt_path=None):
+    entry = probe_video(video_path)
+    entry['keyframes'] = keyframe_times(video_path, entry['start_time']) if keyframes else None
+    entry['vtt_path'] = vtt_path
+    return entry
+
+def build_index(index, directories, workers=8, keyframes=False, prune=False):
+    # Probes the videos that are new or changed since the last build, ffprobe runs in worker threads
+    # and only the calling thread writes to the index. Every folder is listed once, YouTubeASL
+    # subtitles sit next to their video as <id>.<language>.vtt
+    vtt_paths = {}
+    for directory in directories:
+        listing = DirectoryIndex(directory)
+        for files in listing.files.values():
+            for name in files['videos']:
+                vtts = sorted(files['vtts'])
+                vtt_paths[os.path.abspath(os.path.join(directory, name))] = os.path.abspath(os.path.join(directory, vtts[0])) if vtts else None
+    paths = sorted(vtt_paths)
+    stale = [path for path in paths if (entry := index.lookup(path)) is None or (keyframes and entry['keyframes'] is None)]
+    print(f"{len(paths) - len(stale)}/{len(paths)} videos up to date, probing {len(stale)}")
+
+    start = time.time()
+    failed = 0
+    with ThreadPoolExecutor(workers) as executor:
+        futures = {executor.submit(index_entry, path, keyframes, vtt_paths[path]): path for path in stale}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                index.store(futures[future], future.result())
+            except (IOError, ValueError, KeyError) as e:
+                failed += 1
+                print(f"Probing {futures[future]} failed: {e}")
+            if done % 1000 == 0:
+                print(f"Probed {done}/{len(stale)} videos in {time.time() - start:.1f}s")
+
+    if prune:
+        existing = set(paths)
+        removed = [path for directory in directories for path in index.paths(os.path.join(os.path.abspath(directory), ''))
+                   if path not in existing and os.path.dirname(path) == os.path.abspath(directory)]
+        index.remove(removed)
+        print(f"Removed {len(removed)} entries of deleted videos")
+    print(f"Indexed {len(stale) - failed} videos in {time.time() - start:.1f}s, {failed} failed")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build or refresh the media metadata index of the corpus")
+    parser.add_argument('--index', type=str, required=True, help="Path to the SQLite index")
+    parser.add_argument('--input', type=str, nargs='+', required=True, help="Folders of the videos or clips to index")
+    parser.add_argument('--workers', type=int, default=8, help="Number of ffprobe processes run in parallel")
+    parser.add_argument('--keyframes', action='store_true', help="Also store the keyframe timestamps, read from the packets of the whole file")
+    parser.add_argument('--prune', action='store_true', help="Remove the entries of videos no longer in the input folders")
+    args = parser.parse_args()
+
+    index = MediaIndex(args.index)
+    build_index(index, args.input, args.workers, args.keyframes, args.prune)
+    index.close()
@@ -0,0 +1,133 @@
+import os
+import shutil
+import logging
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+class Prefetcher:
+    # Copies input files from network storage to local scratch in background threads. The copies
+    # share a byte budget, a file that does not fit is not prefetched and is read from its original
+    # place instead, so a full scratch never blocks the caller
+    def __init__(self, scratch_dir, max_bytes=20 * 1024 ** 3, threads=2):
+        self.scratch_dir = scratch_dir
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.counter = itertools.count()
+        self.executor = ThreadPoolExecutor(threads)
+        os.makedirs(scratch_dir, exist_ok=True)
+
+    def schedule(self, path):
+        if path not in self.entries:
+            self.entries[path] = self.executor.submit(self.copy, path, next(self.counter))
+
+    def copy(self, path, index):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return path, 0
+        with self.lock:
+            if self.used_bytes + size > self.max_bytes:
+                logging.info(f"Scratch budget full, reading {path} from its original location")
+                return path, 0
+            self.used_bytes += size
+
+        local_path = os.path.join(self.scratch_dir, f"{index:06d}_{os.path.basename(path)}")
+        tmp_path = f"{local_path}.tmp"
+        try:
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, local_path)
+        except OSError as e:
+            logging.warning(f"Prefetch of {path} failed, reading it from its original location: {e}")
+            with self.lock:
+                self.used_bytes -= size
+            for leftover in (tmp_path, local_path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            return path, 0
+        return local_path, size
+
+    def get(self, path):
+        # Local copy of the file, waits for a copy still in progress
+        self.schedule(path)
+        local_path, _ = self.entries[path].result()
+        return local_path
+
+    def release(self, path):
+        future = self.entries.pop(path, None)
+        if future is None:
+            return
+        local_path, size = future.result()
+        if size:
+            try:
+                os.remove(local_path)
+            except FileNotFoundError:
+                pass
+            with self.lock:
+                self.used_bytes -= size
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for path in list(self.entries):
+            self.release(path)
+
+class OutputMover:
+    # Moves finished outputs from local scratch to their final place in a background thread. The
+    # destination is written under a temporary name and renamed, so partial outputs are never visible
+    def __init__(self, threads=1):
+        self.executor = ThreadPoolExecutor(threads)
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def move(self, local_path, final_path, tag=None):
+        with self.lock:
+            self.pending.append((self.executor.submit(self.copy, local_path, final_path), tag))
+
+    @staticmethod
+    def copy(local_path, final_path):
+        tmp_path = f"{final_path}.tmp{os.getpid()}"
+        shutil.copyfile(local_path, tmp_path)
+        os.replace(tmp_path, final_path)
+        os.remove(local_path)
+
+    def finished(self, wait=False):
+        # (tag, error) of every move completed since the last call, error is None on success
+        with self.lock:
+            moves, self.pending = self.pending, []
+        done, pending = [], []
+        for future, tag in moves:
+            if wait or future.done():
+                done.append((tag, future.exception()))
+            else:
+                pending.append((future, tag))
+        with self.lock:
+            self.pending = pending + self.pending
+        return done
+
+    def close(self):
+        done = self.finished(wait=True)
+        self.executor.shutdown(wait=True)
+        return done
+
+def prefetched(items, prefetcher, path_of, lookahead=2):
+    # Yields (item, local path) in order while the files of the next lookahead items are prefetched
+    if prefetcher is None:
+        for item in items:
+            yield item, path_of(item)
+        return
+    items = iter(items)
+    queued = deque()
+    while True:
+        while len(queued) <= lookahead:
+            item = next(items, None)
+            if item is None:
+                break
+            prefetcher.schedule(path_of(item))
+            queued.append(item)
+        if not queued:
+            return
+        item = queued.popleft()
+        yield item, prefetcher.get(path_of(item))
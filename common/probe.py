@@ -0,0 +1,80 @@
+import os
+import json
+import subprocess
+
+def parse_frame_rate(rate):
+    numerator, _, denominator = rate.partition('/')
+    return float(numerator) / float(denominator or 1) if float(denominator or 1) else 0.0
+
+def ffprobe(video_path, *args):
+    result = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0', *args, '-of', 'json', video_path],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise IOError(f"Cannot open video file {video_path}: {result.stderr.strip()}")
+    return json.loads(result.stdout)
+
+def probe_video(video_path):
+    # Frame rate, size, codec and frame count from the container metadata without decoding. Containers
+    # without nb_frames (webm, mkv) have their video packets counted instead, one packet per frame
+    info = ffprobe(video_path, '-show_entries', 'stream=width,height,avg_frame_rate,r_frame_rate,nb_frames,duration,codec_name,pix_fmt,'
+                                                'start_time,bit_rate:format=duration,bit_rate')
+    if not info.get('streams'):
+        raise IOError(f"No video stream in {video_path}")
+    stream = info['streams'][0]
+    container = info.get('format', {})
+    fps = parse_frame_rate(stream.get('avg_frame_rate', '0/0')) or parse_frame_rate(stream.get('r_frame_rate', '0/0'))
+    duration = float(stream.get('duration') or container.get('duration') or 0)
+    if str(stream.get('nb_frames', '')).isdigit() and int(stream['nb_frames']) > 0:
+        total_frames, source = int(stream['nb_frames']), 'nb_frames'
+    else:
+        packets = ffprobe(video_path, '-count_packets', '-show_entries', 'stream=nb_read_packets')['streams'][0].get('nb_read_packets')
+        if packets:
+            total_frames, source = int(packets), 'packets'
+        else:
+            total_frames, source = int(round(duration * fps)), 'duration'
+    bitrate = stream.get('bit_rate') or container.get('bit_rate')
+    return {'fps': fps, 'width': int(stream['width']), 'height': int(stream['height']), 'total_frames': total_frames, 'source': source,
+            'duration': duration, 'bitrate': int(bitrate) if str(bitrate).isdigit() else None, 'codec': stream.get('codec_name'),
+            'pix_fmt': stream.get('pix_fmt'), 'start_time': float(stream.get('start_time') or 0)}
+
+def keyframe_times(video_path, start_time=0.0):
+    # Times of the video keyframes relative to the stream start, read from the packet flags without decoding
+    info = ffprobe(video_path, '-show_entries', 'packet=pts_time,flags')
+    return sorted(float(packet['pts_time']) - start_time for packet in info.get('packets', [])
+                  if 'K' in packet.get('flags', '') and packet.get('pts_time', 'N/A') != 'N/A')
+
+class ProbeCache:
+    # JSON sidecar index of probe results keyed by file name and size of the original video, so
+    # repeated runs skip ffprobe altogether
+    def __init__(self, path, save_every=50):
+        self.path = path
+        self.save_every = save_every
+        self.unsaved = 0
+        try:
+            with open(path) as file:
+                self.entries = json.load(file)
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+
+    @staticmethod
+    def key(video_path):
+        return f"{os.path.basename(video_path)}:{os.path.getsize(video_path)}"
+
+    def probe(self, video_path, local_path=None):
+        # local_path is a copy of video_path to run ffprobe on, e.g. a prefetched one
+        key = self.key(video_path)
+        if key not in self.entries:
+            self.entries[key] = probe_video(local_path or video_path)
+            self.unsaved += 1
+            if self.unsaved >= self.save_every:
+                self.save()
+        return self.entries[key]
+
+    def save(self):
+        if not self.unsaved:
+            return
+        tmp_path = f"{self.path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w') as file:
+            json.dump(self.entries, file)
+        os.replace(tmp_path, self.path)
+        self.unsaved = 0
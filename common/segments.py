@@ -0,0 +1,113 @@
+import os
+import csv
+import shutil
+import tempfile
+import subprocess
+
+def single_pass_ranges(ranges):
+    # Indices of the (start, end) ranges that can be cut from one segmented pass, in time order, and
+    # of the ranges overlapping an earlier one, which have to be cut separately
+    single, overlapping = [], []
+    last_end = None
+    for index in sorted(range(len(ranges)), key=lambda i: ranges[i]):
+        start, end = ranges[index]
+        if end <= start or (last_end is not None and start < last_end):
+            overlapping.append(index)
+        else:
+            single.append(index)
+            last_end = end
+    return single, overlapping
+
+def process_clip(video_path, start_time, duration, segment_file, encoder_profile=None):
+    # Stream copy cuts at the keyframes around the boundaries, an encoder profile cuts frame-accurately
+    codec_args = encoder_profile.command_args() if encoder_profile else ["-c", "copy"]
+    command = [
+        'ffmpeg', "-ss", str(start_time), "-i", video_path, "-t", str(duration),
+        *codec_args, segment_file
+    ]
+    subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    print(f"Finished processing segment: {segment_file}")
+
+    return segment_file
+
+def split_segments(video_path, ranges, output_files, encoder_profile=None, max_shift=0.04):
+    # Demuxes the source once and writes every non-overlapping (start, end) range in seconds to its
+    # output file with the segment muxer, the gaps between ranges become segments that are dropped.
+    # Segments split on keyframes, forced at the split times when re-encoding, so a range whose segment
+    # starts or ends more than max_shift seconds away from the request is not written. Returns
+    # {index: (start, end)} of the written ranges with the bounds of the segment actually written
+    single, _ = single_pass_ranges(ranges)
+    if not single:
+        return {}
+    points = sorted({time for index in single for time in ranges[index]})
+    split_times = [time for time in points if 0 < time < points[-1]]
+
+    tmp_dir = tempfile.mkdtemp(prefix='.cuts_', dir=os.path.dirname(os.path.abspath(output_files[single[0]])))
+    list_path = os.path.join(tmp_dir, 'segments.csv')
+    if encoder_profile:
+        # Forced keyframes at the split times make the re-encoded cuts frame-accurate
+        codec_args = [*encoder_profile.command_args(), '-force_key_frames', ','.join(f"{time:.6f}" for time in split_times)]
+    else:
+        codec_args = ['-c', 'copy']
+    command = [
+        'ffmpeg', '-v', 'error', '-i', video_path, '-to', f"{points[-1]:.6f}", *codec_args,
+        '-f', 'segment', '-segment_times', ','.join(f"{time:.6f}" for time in split_times) or str(points[-1]),
+        '-reset_timestamps', '1', '-segment_list', list_path, '-segment_list_type', 'csv',
+        os.path.join(tmp_dir, f"%05d{os.path.splitext(output_files[single[0]])[1]}")
+    ]
+    try:
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if not os.path.exists(list_path):
+            return {}
+        with open(list_path, newline='') as file:
+            segments = [(os.path.join(tmp_dir, name), float(start), float(end)) for name, start, end in csv.reader(file)]
+
+        written = {}
+        for index in single:
+            start, end = ranges[index]
+            for segment in segments:
+                segment_file, segment_start, segment_end = segment
+                if abs(segment_start - start) <= max_shift and abs(segment_end - end) <= max_shift:
+                    os.replace(segment_file, output_files[index])
+                    segments.remove(segment)
+                    written[index] = (segment_start, segment_end)
+                    break
+        return written
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def staged_path(segment_file, staging_dir=None, mover=None):
+    return os.path.join(staging_dir, os.path.basename(segment_file)) if mover else segment_file
+
+def move_clip(local_file, segment_file, mover=None):
+    # Cut on local scratch, the clips are moved to the output folder in the background
+    if mover is not None and os.path.exists(local_file):
+        mover.move(local_file, segment_file, segment_file)
+
+def split_clips(video_path, segments, encoder_profile, staging_dir=None, mover=None, max_shift=0.04):
+    # One split_segments pass over the (start_time, duration, segment_file) segments. Returns the
+    # (segment_file, start_time, end_time) bounds of the clips it wrote and the segments still to cut
+    local_files = [staged_path(segment_file, staging_dir, mover) for _, _, segment_file in segments]
+    ranges = [(start_time, start_time + duration) for start_time, duration, _ in segments]
+    written = split_segments(video_path, ranges, local_files, encoder_profile, max_shift)
+    print(f"Cut {len(written)}/{len(segments)} segments of {video_path} in a single pass")
+    bounds = []
+    for i in sorted(written):
+        bounds.append((segments[i][2], *written[i]))
+        move_clip(local_files[i], segments[i][2], mover)
+    return bounds, [segment for i, segment in enumerate(segments) if i not in written]
+
+def cut_clips(video_path, segments, encoder_profile=None, staging_dir=None, mover=None, single_pass=False, max_shift=0.04):
+    # segments are (start_time, duration, segment_file), each cut by its own ffmpeg process. In single
+    # pass mode the source is first demuxed once for all of them, only with an encoder profile: stream
+    # copy splits on the source keyframes, which hardly ever match a requested bound. Returns
+    # (segment_file, start_time, end_time) of every segment with the bounds it was cut at
+    bounds = []
+    if single_pass and encoder_profile is not None and len(segments) > 1:
+        bounds, segments = split_clips(video_path, segments, encoder_profile, staging_dir, mover, max_shift)
+    for start_time, duration, segment_file in segments:
+        local_file = staged_path(segment_file, staging_dir, mover)
+        process_clip(video_path, start_time, duration, local_file, encoder_profile)
+        bounds.append((segment_file, start_time, start_time + duration))
+        move_clip(local_file, segment_file, mover)
+    return bounds